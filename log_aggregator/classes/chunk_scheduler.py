@@ -0,0 +1,261 @@
+import concurrent.futures
+import statistics
+import time
+from collections import deque
+
+def _timed_call(fn, *args):
+    # Runs in the worker, so the duration only covers the task itself
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+class ChunkScheduler:
+    """
+    Runs chunk tasks on an executor with per chunk retries, timeouts and speculative re-execution of stragglers
+    Every chunk is accepted exactly once, results of duplicate attempts are discarded
+    At most max_workers attempts are handed to the executor at a time, so a submitted attempt always has a worker and
+    its timeout clock does not include time spent waiting in the executor queue
+    """
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, executor_factory, max_workers, max_retries=2, timeout=0, speculation_threshold=0.9,
+                 speculation_factor=2.0):
+        """
+        Initialize the ChunkScheduler class
+
+        Parameters:
+            executor_factory (callable): Creates the executor the chunk tasks run on, called again when the executor
+                breaks or every worker is held by a stuck attempt
+            max_workers (int): Workers of the executor
+            max_retries (int): Extra attempts for a chunk whose task raised or timed out
+            timeout (float): Seconds a running attempt may take before another attempt is started, 0 disables
+            speculation_threshold (float): Fraction of finished chunks after which stragglers are re-executed, 1 disables
+            speculation_factor (float): A running attempt is a straggler once it takes this many times the median chunk time
+        """
+        self.executor_factory = executor_factory
+        self.executor = executor_factory()
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.speculation_threshold = speculation_threshold
+        self.speculation_factor = speculation_factor
+
+        # chunk_id -> (fn, args), kept until the chunk is accepted or failed for good
+        self._tasks = {}
+        self._attempts = {}
+        # Chunk ids of attempts waiting for a free worker
+        self._queue = deque()
+        # future -> chunk_id of every attempt that has not been collected yet
+        self._pending = {}
+        # future -> time the attempt was handed to a free worker
+        self._submitted_at = {}
+        # future -> generation of the executor it was submitted to, bumped on every executor restart
+        self._generations = {}
+        self._generation = 0
+        self._timed_out = set()
+        self._speculated = set()
+        # Task durations measured in the workers
+        self._durations = []
+        self._finished = set()
+        # Attempts that were still running when their chunk finished
+        self._abandoned = []
+        self._next_id = 0
+
+        self.failed = {}
+        self.stats = {"retries": 0, "timeouts": 0, "speculative": 0, "duplicates_discarded": 0, "pool_restarts": 0}
+
+    def submit(self, fn, *args):
+        """
+        Submit a chunk task
+
+        Parameters:
+            fn (callable): Picklable task, called as fn(*args)
+            *args: Task arguments, kept for retries until the chunk finishes
+
+        Returns:
+            int: The chunk id
+        """
+        chunk_id = self._next_id
+        self._next_id += 1
+        self._tasks[chunk_id] = (fn, args)
+        self._attempts[chunk_id] = 0
+        self._start_attempt(chunk_id)
+        return chunk_id
+
+    def reject(self, chunk_id, error):
+        """
+        Record an accepted chunk whose result could not be used as failed
+
+        Parameters:
+            chunk_id (int): Chunk id as returned by submit
+            error (str): Why the result was rejected
+        """
+        self.failed[chunk_id] = str(error)
+
+    def _start_attempt(self, chunk_id):
+        self._attempts[chunk_id] += 1
+        self._queue.append(chunk_id)
+        self._fill_workers()
+
+    def _busy_workers(self):
+        # Attempts of the current executor that hold a worker, including timed out and abandoned ones
+        return [
+            future for future in list(self._pending) + self._abandoned
+            if self._generations.get(future) == self._generation and not future.done()
+        ]
+
+    def _fill_workers(self):
+        busy = self._busy_workers()
+        if self._queue and len(busy) >= self.max_workers and all(
+                future in self._timed_out or future not in self._pending for future in busy):
+            # Every worker is held by a stuck or abandoned attempt, nothing queued could ever start
+            for future in busy:
+                self._discard(future)
+            self._restart_executor()
+            busy = []
+
+        while self._queue and len(busy) < self.max_workers:
+            chunk_id = self._queue.popleft()
+            if chunk_id in self._finished:
+                continue
+            busy.append(self._submit(chunk_id))
+
+    def _submit(self, chunk_id):
+        fn, args = self._tasks[chunk_id]
+        try:
+            future = self.executor.submit(_timed_call, fn, *args)
+        except concurrent.futures.BrokenExecutor:
+            # A worker died before its failed attempts were collected, they fail with the same error when they are
+            self._restart_executor()
+            future = self.executor.submit(_timed_call, fn, *args)
+        self._pending[future] = chunk_id
+        self._submitted_at[future] = time.monotonic()
+        self._generations[future] = self._generation
+        return future
+
+    def _discard(self, future):
+        self._pending.pop(future, None)
+        self._submitted_at.pop(future, None)
+        self._generations.pop(future, None)
+        self._timed_out.discard(future)
+
+    def _restart_executor(self):
+        self._stop_executor(terminate=True)
+        self.executor = self.executor_factory()
+        self._generation += 1
+        self.stats["pool_restarts"] += 1
+
+    def _in_flight(self, chunk_id):
+        return [future for future, pending_id in self._pending.items() if pending_id == chunk_id]
+
+    def _live_attempts(self, chunk_id):
+        # Timed out attempts are still in flight but are not expected to finish
+        return [future for future in self._in_flight(chunk_id) if future not in self._timed_out]
+
+    def _finish(self, chunk_id):
+        # Returns the number of abandoned attempts
+        abandoned = 0
+        self._finished.add(chunk_id)
+        del self._tasks[chunk_id]
+        # Abandon the remaining attempts, running ones cannot be stopped in the pool and are terminated by shutdown
+        for future in self._in_flight(chunk_id):
+            if not future.cancel():
+                self._abandoned.append(future)
+            del self._pending[future]
+            self._submitted_at.pop(future, None)
+            self._timed_out.discard(future)
+            abandoned += 1
+        return abandoned
+
+    def results(self):
+        """
+        Wait for the submitted chunks and yield every accepted result once
+        Chunks that failed on every attempt are recorded in failed
+
+        Yields:
+            tuple: (chunk_id, result)
+        """
+        while self._pending or self._queue:
+            self._fill_workers()
+            done, _ = concurrent.futures.wait(
+                self._pending, timeout=self.POLL_INTERVAL, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            for future in done:
+                chunk_id = self._pending.get(future)
+                generation = self._generations.get(future)
+                self._discard(future)
+                # Attempts of a chunk that already finished were abandoned by _finish
+                if chunk_id is None or chunk_id in self._finished:
+                    continue
+
+                try:
+                    duration, result = future.result()
+                except concurrent.futures.BrokenExecutor as e:
+                    # A dead worker breaks the whole executor, every attempt on it fails and is retried on a new one
+                    if generation == self._generation:
+                        self._restart_executor()
+                    self._handle_failure(chunk_id, e)
+                    continue
+                except Exception as e:
+                    self._handle_failure(chunk_id, e)
+                    continue
+
+                self._durations.append(duration)
+                self.stats["duplicates_discarded"] += self._finish(chunk_id)
+                yield chunk_id, result
+
+            self._check_stragglers(time.monotonic())
+
+    def _handle_failure(self, chunk_id, error):
+        # Another attempt of the chunk may still succeed
+        if self._live_attempts(chunk_id) or chunk_id in self._queue:
+            return
+        if self._attempts[chunk_id] <= self.max_retries:
+            self.stats["retries"] += 1
+            self._start_attempt(chunk_id)
+            return
+        self._finish(chunk_id)
+        self.failed[chunk_id] = str(error)
+
+    def _check_stragglers(self, now):
+        finished_ratio = len(self._finished) / self._next_id if self._next_id else 0
+        straggler_limit = None
+        if self._durations and finished_ratio >= self.speculation_threshold:
+            straggler_limit = statistics.median(self._durations) * self.speculation_factor
+
+        for future, submitted in list(self._submitted_at.items()):
+            chunk_id = self._pending.get(future)
+            if chunk_id is None or chunk_id in self._finished or future.done():
+                continue
+            elapsed = now - submitted
+
+            # A stuck attempt keeps its worker until the executor is restarted or shut down, a late result is still accepted
+            if self.timeout and elapsed > self.timeout and future not in self._timed_out:
+                self._timed_out.add(future)
+                self.stats["timeouts"] += 1
+                self._handle_failure(chunk_id, f"Timed out after {self.timeout} seconds")
+                continue
+
+            if (straggler_limit is not None and elapsed > straggler_limit
+                    and chunk_id not in self._speculated and len(self._live_attempts(chunk_id)) == 1):
+                self._speculated.add(chunk_id)
+                self.stats["speculative"] += 1
+                self._queue.append(chunk_id)
+                self._fill_workers()
+
+    def _stop_executor(self, terminate):
+        # ProcessPoolExecutor has no public API to stop a running task and drops its process table on shutdown
+        processes = list((getattr(self.executor, "_processes", None) or {}).values()) if terminate else []
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def shutdown(self):
+        """
+        Shut the executor down without waiting for abandoned attempts
+        Worker processes still running an abandoned or timed out attempt are terminated, otherwise the interpreter
+        would join them at exit and hang on a stuck chunk
+        """
+        self._stop_executor(terminate=any(not future.done() for future in list(self._pending) + self._abandoned))
@@ -157,6 +157,28 @@ class LogAggregatorConfig(BaseConfig):
     ALLOWED_SORT_ORDERS = {"asc", "desc"}
     DEFAULT_TIMING_SPIKE_THRESHOLD = 1.3 
     DEFAULT_ERROR_SPIKE_THRESHOLD = 1.3  
+    DEFAULT_INGEST_HOST = "127.0.0.1"
+    DEFAULT_INGEST_TCP_PORT = 5140
+    DEFAULT_INGEST_UDP_PORT = 5140
+    DEFAULT_INGEST_QUEUE_SIZE = 10000
+    DEFAULT_ALLOWED_LATENESS = 60
+    DEFAULT_MAX_OPEN_WINDOWS = 64
+    DEFAULT_MAX_CLOSED_WINDOWS = 1440
+    DEFAULT_INGEST_MAX_TRACKED_KEYS = 10000
+    DEFAULT_MAX_EVENT_TIME_SKEW = 300
+    DEFAULT_HLL_ERROR_RATE = 0.02
+    DEFAULT_STORE_PATH = ""
+    DEFAULT_MAX_ROUTE_SERIES = 20
+    DEFAULT_SERIES_SPIKE_THRESHOLD = 2.0
+    DEFAULT_SERIES_SPIKE_MIN_COUNT = 10
+    DEFAULT_SAMPLE_FRACTION = 0.01
+    DEFAULT_SAMPLE_BLOCK_SIZE = 1048576
+    DEFAULT_SAMPLE_CONFIDENCE = 0.95
+    DEFAULT_SAMPLE_SEED = -1
+    DEFAULT_CHUNK_MAX_RETRIES = 2
+    DEFAULT_CHUNK_TIMEOUT = 300.0
+    DEFAULT_SPECULATION_THRESHOLD = 0.9
+    DEFAULT_SPECULATION_FACTOR = 2.0
 
     def __init__(self, config_path):
         super().__init__(config_path)
@@ -181,3 +203,61 @@ class LogAggregatorConfig(BaseConfig):
         
         self.timing_spike_threshold = self.get_float("timing_spike_threshold", self.DEFAULT_TIMING_SPIKE_THRESHOLD)
         self.error_spike_threshold = self.get_float("error_spike_threshold", self.DEFAULT_ERROR_SPIKE_THRESHOLD)
+
+        # Relative standard error of the per bucket distinct referrer and user agent counts
+        self.hll_error_rate = self.get_float("hll_error_rate", self.DEFAULT_HLL_ERROR_RATE)
+        if not 0 < self.hll_error_rate < 1:
+            raise ValueError("hll_error_rate must be between 0 and 1")
+
+        # Directory of the on-disk time series store, empty string disables persisting results
+        self.store_path = self.get_str("store_path", self.DEFAULT_STORE_PATH)
+
+        # Per route and per status class spike detection, only the most requested routes are tracked
+        self.max_route_series = self.get_int("max_route_series", self.DEFAULT_MAX_ROUTE_SERIES)
+        self.series_spike_threshold = self.get_float("series_spike_threshold", self.DEFAULT_SERIES_SPIKE_THRESHOLD)
+        self.series_spike_min_count = self.get_int("series_spike_min_count", self.DEFAULT_SERIES_SPIKE_MIN_COUNT)
+        if self.max_route_series < 0:
+            raise ValueError("max_route_series must not be negative")
+
+        # Sampled aggregation, a negative seed picks random blocks on every run
+        self.sample_fraction = self.get_float("sample_fraction", self.DEFAULT_SAMPLE_FRACTION)
+        self.sample_block_size = self.get_int("sample_block_size", self.DEFAULT_SAMPLE_BLOCK_SIZE)
+        self.sample_confidence = self.get_float("sample_confidence", self.DEFAULT_SAMPLE_CONFIDENCE)
+        self.sample_seed = self.get_int("sample_seed", self.DEFAULT_SAMPLE_SEED)
+        if not 0 < self.sample_fraction <= 1:
+            raise ValueError("sample_fraction must be greater than 0 and at most 1")
+        if self.sample_block_size < 1:
+            raise ValueError("sample_block_size must be positive")
+        if not 0 < self.sample_confidence < 1:
+            raise ValueError("sample_confidence must be between 0 and 1")
+
+        # Worker pool fault tolerance, a chunk_timeout of 0 disables timeouts and a speculation_threshold of 1 disables speculation
+        self.chunk_max_retries = self.get_int("chunk_max_retries", self.DEFAULT_CHUNK_MAX_RETRIES)
+        self.chunk_timeout = self.get_float("chunk_timeout", self.DEFAULT_CHUNK_TIMEOUT)
+        self.speculation_threshold = self.get_float("speculation_threshold", self.DEFAULT_SPECULATION_THRESHOLD)
+        self.speculation_factor = self.get_float("speculation_factor", self.DEFAULT_SPECULATION_FACTOR)
+        if self.chunk_max_retries < 0 or self.chunk_timeout < 0:
+            raise ValueError("chunk_max_retries and chunk_timeout must not be negative")
+        if not 0 < self.speculation_threshold <= 1 or self.speculation_factor < 1:
+            raise ValueError("speculation_threshold must be greater than 0 and at most 1, speculation_factor at least 1")
+
+        # Live ingestion settings
+        self.ingest_host = self.get_str("ingest_host", self.DEFAULT_INGEST_HOST)
+        self.ingest_tcp_port = self.get_int("ingest_tcp_port", self.DEFAULT_INGEST_TCP_PORT)
+        self.ingest_udp_port = self.get_int("ingest_udp_port", self.DEFAULT_INGEST_UDP_PORT)
+        self.ingest_queue_size = self.get_int("ingest_queue_size", self.DEFAULT_INGEST_QUEUE_SIZE)
+        # Seconds the watermark trails the newest event time seen, lines older than a closed window are dropped
+        self.allowed_lateness = self.get_int("allowed_lateness", self.DEFAULT_ALLOWED_LATENESS)
+        self.max_open_windows = self.get_int("max_open_windows", self.DEFAULT_MAX_OPEN_WINDOWS)
+        self.max_closed_windows = self.get_int("max_closed_windows", self.DEFAULT_MAX_CLOSED_WINDOWS)
+        # Routes and response codes counted over the whole run, the least requested ones are dropped beyond this
+        self.ingest_max_tracked_keys = self.get_int("ingest_max_tracked_keys", self.DEFAULT_INGEST_MAX_TRACKED_KEYS)
+        if (self.ingest_queue_size < 1 or self.max_open_windows < 1 or self.max_closed_windows < 1
+                or self.ingest_max_tracked_keys < 1):
+            raise ValueError(
+                "ingest_queue_size, max_open_windows, max_closed_windows and ingest_max_tracked_keys must be positive"
+            )
+        # Seconds an event time may lie ahead of the wall clock, later lines would move the watermark for good
+        self.max_event_time_skew = self.get_int("max_event_time_skew", self.DEFAULT_MAX_EVENT_TIME_SKEW)
+        if self.allowed_lateness < 0 or self.max_event_time_skew < 0:
+            raise ValueError("allowed_lateness and max_event_time_skew must not be negative")
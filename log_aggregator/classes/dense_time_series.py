@@ -0,0 +1,200 @@
+from array import array
+from itertools import compress
+
+class DenseTimeSeries:
+    """
+    Request and error counts per time bucket stored in fixed size int64 array segments
+    Position i of segment s holds bucket index s * SEGMENT_SIZE + i, so building, merging and ordering never create
+    per bucket objects, while a far outlier timestamp only costs one extra segment instead of the whole gap
+    """
+    SEGMENT_SIZE = 256
+    # Segments with fewer used buckets than this are merged bucket by bucket and pickled as their used buckets only
+    SPARSE_LIMIT = SEGMENT_SIZE // 8
+
+    def __init__(self):
+        """
+        Initialize an empty DenseTimeSeries
+        """
+        # segment_id -> (totals, errors)
+        self.segments = {}
+
+    def __getstate__(self):
+        # Small chunks and sampled blocks spread few requests over many segments, so most segments are nearly empty
+        # so their used buckets are flattened into one (indexes, totals, errors) triple of arrays
+        segments = {}
+        sparse = (array("q"), array("q"), array("q"))
+        for segment_id, (totals, errors) in self.segments.items():
+            positions = list(compress(range(self.SEGMENT_SIZE), totals))
+            if len(positions) >= self.SPARSE_LIMIT:
+                segments[segment_id] = (totals, errors)
+                continue
+            base = segment_id * self.SEGMENT_SIZE
+            for position in positions:
+                sparse[0].append(base + position)
+                sparse[1].append(totals[position])
+                sparse[2].append(errors[position])
+        return {"segments": segments, "sparse": sparse}
+
+    def __setstate__(self, state):
+        self.segments = state["segments"]
+        for index, total, errors in zip(*state["sparse"]):
+            self.add(index, total, errors)
+
+    def _segment(self, segment_id):
+        segment = self.segments.get(segment_id)
+        if segment is None:
+            segment = (array("q", bytes(8 * self.SEGMENT_SIZE)), array("q", bytes(8 * self.SEGMENT_SIZE)))
+            self.segments[segment_id] = segment
+        return segment
+
+    def add(self, index, total=1, errors=0):
+        """
+        Add counts to a bucket
+
+        Parameters:
+            index (int): Bucket index as returned by LogAggregator.get_bucket_index
+            total (int): Requests to add
+            errors (int): Errors to add
+        """
+        segment_id, position = divmod(index, self.SEGMENT_SIZE)
+        totals, error_counts = self._segment(segment_id)
+        totals[position] += total
+        error_counts[position] += errors
+
+    def merge(self, other):
+        """
+        Add another series into this one in place
+
+        Parameters:
+            other (DenseTimeSeries): The series to merge
+
+        Returns:
+            DenseTimeSeries: This series
+        """
+        for segment_id, (other_totals, other_errors) in other.segments.items():
+            if segment_id not in self.segments:
+                self.segments[segment_id] = (array("q", other_totals), array("q", other_errors))
+                continue
+            totals, errors = self.segments[segment_id]
+            positions = list(compress(range(self.SEGMENT_SIZE), other_totals))
+            if len(positions) < self.SPARSE_LIMIT:
+                for position in positions:
+                    totals[position] += other_totals[position]
+                    errors[position] += other_errors[position]
+                continue
+            self.segments[segment_id] = (
+                array("q", map(int.__add__, totals, other_totals)),
+                array("q", map(int.__add__, errors, other_errors))
+            )
+        return self
+
+    def get(self, index):
+        """
+        Get the counts of a bucket
+
+        Parameters:
+            index (int): Bucket index
+
+        Returns:
+            tuple or None: (total, errors) or None if the bucket has no requests
+        """
+        segment_id, position = divmod(index, self.SEGMENT_SIZE)
+        segment = self.segments.get(segment_id)
+        if segment is None or segment[0][position] == 0:
+            return None
+        return segment[0][position], segment[1][position]
+
+    def segment_ids(self, reverse=False):
+        """
+        Get the ids of the allocated segments in bucket order
+
+        Parameters:
+            reverse (bool): Start from the newest segment
+
+        Returns:
+            list of int: The segment ids
+        """
+        return sorted(self.segments, reverse=reverse)
+
+    def buckets(self, reverse=False):
+        """
+        Iterate over the buckets that have requests in index order
+
+        Parameters:
+            reverse (bool): Iterate from the newest bucket
+
+        Yields:
+            tuple: (index, total, errors)
+        """
+        positions = range(self.SEGMENT_SIZE - 1, -1, -1) if reverse else range(self.SEGMENT_SIZE)
+        for segment_id in self.segment_ids(reverse):
+            totals, errors = self.segments[segment_id]
+            base = segment_id * self.SEGMENT_SIZE
+            # Only the used positions are visited, the series of one small block is mostly empty
+            for position in compress(positions, totals[::-1] if reverse else totals):
+                yield base + position, totals[position], errors[position]
+
+    def sums(self):
+        """
+        Sum the counts over all buckets
+
+        Returns:
+            tuple: (total, errors)
+        """
+        return (
+            sum(sum(totals) for totals, _ in self.segments.values()),
+            sum(sum(errors) for _, errors in self.segments.values())
+        )
+
+    def trim(self, index):
+        """
+        Drop every bucket before the given index
+
+        Parameters:
+            index (int): Bucket index of the first bucket to keep
+        """
+        first_segment, position = divmod(index, self.SEGMENT_SIZE)
+        for segment_id in [segment_id for segment_id in self.segments if segment_id < first_segment]:
+            del self.segments[segment_id]
+        if position and first_segment in self.segments:
+            totals, errors = self.segments[first_segment]
+            totals[:position] = array("q", bytes(8 * position))
+            errors[:position] = array("q", bytes(8 * position))
+            if not any(totals):
+                del self.segments[first_segment]
+
+    def is_empty(self):
+        """
+        Check if the series holds no segments
+
+        Returns:
+            bool: True if no bucket was ever added
+        """
+        return not self.segments
+
+    def scaled(self, factor):
+        """
+        Create a copy of the series with every count multiplied by a factor and rounded
+
+        Parameters:
+            factor (float): The scale factor
+
+        Returns:
+            DenseTimeSeries: The scaled copy
+        """
+        series = DenseTimeSeries()
+        for segment_id, (totals, errors) in self.segments.items():
+            series.segments[segment_id] = (
+                array("q", (round(total * factor) for total in totals)),
+                array("q", (round(error * factor) for error in errors))
+            )
+        return series
+
+    def bucket_count(self):
+        """
+        Count the buckets that have requests
+
+        Returns:
+            int: Number of non empty buckets
+        """
+        return sum(self.SEGMENT_SIZE - totals.count(0) for totals, _ in self.segments.values())
@@ -0,0 +1,148 @@
+import hashlib
+import math
+from array import array
+
+class HyperLogLog:
+    """
+    Mergeable HyperLogLog sketch for approximate distinct counts in a fixed amount of memory
+    Starts with a sparse {register: rank} dict and switches to a dense register array once that stops paying off,
+    so low cardinality buckets stay small to build, pickle and merge
+    """
+    MIN_PRECISION = 4
+    MAX_PRECISION = 16
+
+    def __init__(self, error_rate=0.02):
+        """
+        Initialize the HyperLogLog class
+        The number of registers is derived from the error rate, the standard error is about 1.04 / sqrt(registers)
+
+        Parameters:
+            error_rate (float): Desired relative standard error, between 0 and 1
+
+        Raises:
+            ValueError: If the error rate is not between 0 and 1
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        precision = math.ceil(math.log2((1.04 / error_rate) ** 2))
+        self.precision = max(self.MIN_PRECISION, min(self.MAX_PRECISION, precision))
+        self.register_count = 1 << self.precision
+        # Dense mode uses one byte per register, e.g. 4KB for the default error rate
+        self.registers = None
+        self._sparse = {}
+        self._sparse_limit = self.register_count // 32
+        self._cached_count = None
+
+    def __getstate__(self):
+        # Sketches are pickled per bucket and route, so only the registers are kept, the rest follows from the precision
+        if self.registers is None:
+            return self.precision, array("H", self._sparse), bytes(self._sparse.values())
+        return self.precision, self.registers
+
+    def __setstate__(self, state):
+        self.precision = state[0]
+        self.register_count = 1 << self.precision
+        self._sparse_limit = self.register_count // 32
+        self._cached_count = None
+        if len(state) == 2:
+            self.registers = state[1]
+            self._sparse = None
+        else:
+            self.registers = None
+            self._sparse = dict(zip(state[1], state[2]))
+
+    def _densify(self):
+        self.registers = bytearray(self.register_count)
+        for index, rank in self._sparse.items():
+            self.registers[index] = rank
+        self._sparse = None
+
+    def add(self, value):
+        """
+        Add a value to the sketch
+
+        Parameters:
+            value (str): The value to count
+        """
+        hashed = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+        remaining_bits = 64 - self.precision
+        index = hashed >> remaining_bits
+        # Position of the leftmost 1 bit in the remaining bits
+        rank = remaining_bits - (hashed & ((1 << remaining_bits) - 1)).bit_length() + 1
+        if self.registers is None:
+            if rank > self._sparse.get(index, 0):
+                self._sparse[index] = rank
+                self._cached_count = None
+                if len(self._sparse) > self._sparse_limit:
+                    self._densify()
+        elif rank > self.registers[index]:
+            self.registers[index] = rank
+            self._cached_count = None
+
+    def merge(self, other):
+        """
+        Union another sketch into this one in place
+
+        Parameters:
+            other (HyperLogLog): A sketch created with the same error rate
+
+        Returns:
+            HyperLogLog: This sketch
+
+        Raises:
+            ValueError: If the sketches have a different precision
+        """
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+        if other.registers is None:
+            if self.registers is None:
+                for index, rank in other._sparse.items():
+                    if rank > self._sparse.get(index, 0):
+                        self._sparse[index] = rank
+                if len(self._sparse) > self._sparse_limit:
+                    self._densify()
+            else:
+                for index, rank in other._sparse.items():
+                    if rank > self.registers[index]:
+                        self.registers[index] = rank
+        else:
+            if self.registers is None:
+                self._densify()
+            self.registers = bytearray(map(max, self.registers, other.registers))
+        self._cached_count = None
+        return self
+
+    def count(self):
+        """
+        Estimate the number of distinct values added to the sketch
+
+        Returns:
+            int: The estimated distinct count
+        """
+        if self._cached_count is not None:
+            return self._cached_count
+
+        m = self.register_count
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+
+        if self.registers is None:
+            zeros = m - len(self._sparse)
+            harmonic_sum = zeros + sum(2.0 ** -rank for rank in self._sparse.values())
+        else:
+            zeros = self.registers.count(0)
+            harmonic_sum = sum(2.0 ** -register for register in self.registers)
+        estimate = alpha * m * m / harmonic_sum
+
+        # Small range correction using linear counting
+        if estimate <= 2.5 * m:
+            if zeros:
+                estimate = m * math.log(m / zeros)
+        self._cached_count = int(round(estimate))
+        return self._cached_count
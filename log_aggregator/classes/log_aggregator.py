@@ -1,13 +1,24 @@
 import concurrent.futures
-from datetime import datetime, timedelta
+import functools
+import math
+import os
+import random
 import statistics
+from datetime import datetime, timedelta
+from itertools import compress
+from classes.chunk_scheduler import ChunkScheduler
+from classes.dense_time_series import DenseTimeSeries
 from classes.http_codes import HttpCodes
+from classes.hyper_log_log import HyperLogLog
 from classes.config import LogAggregatorConfig
 
 class LogAggregator:
     """
     Aggregates log file data by processing log chunks in parallel
     """
+    # Route series tracked per chunk or merged result, as a multiple of max_route_series
+    ROUTE_CANDIDATE_FACTOR = 2
+
     def __init__(self, config_path, http_codes = HttpCodes()):
         """
         Initialize the LogAggregator class
@@ -20,6 +31,18 @@ class LogAggregator:
         # Allows dependcy injection for HttpCodes
         self.http_codes = http_codes if http_codes is not None else HttpCodes()
         self._aggregated_data = {}
+        self._time_series = DenseTimeSeries()
+        self._route_series = {}
+        self._status_class_series = {}
+
+    def __getstate__(self):
+        # Chunk and block tasks pickle the aggregator, results of earlier runs are not needed by the workers
+        state = self.__dict__.copy()
+        state["_aggregated_data"] = {}
+        state["_time_series"] = DenseTimeSeries()
+        state["_route_series"] = {}
+        state["_status_class_series"] = {}
+        return state
 
     def get_time_key(self, timestamp):
         """
@@ -36,7 +59,21 @@ class LogAggregator:
         Raises:
             ValueError: If an unsupported time interval is specified
         """
-        dt = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
+        return self.get_bucket_key(datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S"))
+
+    def get_bucket_key(self, dt):
+        """
+        Floor a datetime to the start of its time bucket based on the aggregation interval
+        
+        Parameters:
+            dt (datetime): The datetime to floor
+        
+        Returns:
+            int: timestamp representing the start of the time bucket
+        
+        Raises:
+            ValueError: If an unsupported time interval is specified
+        """
         if self.config.time_interval == "minute":
             dt_floored = dt.replace(second=0, microsecond=0)
         elif self.config.time_interval == "hour":
@@ -56,10 +93,97 @@ class LogAggregator:
             raise ValueError("Unsupported time interval")
         return int(dt_floored.timestamp())
 
+    def get_bucket_index(self, dt):
+        """
+        Get the consecutive integer index of the time bucket a datetime falls in
+        Neighbouring buckets have neighbouring indexes for every interval, including months and years
+        
+        Parameters:
+            dt (datetime): The datetime to bucket
+        
+        Returns:
+            int: The bucket index
+        
+        Raises:
+            ValueError: If an unsupported time interval is specified
+        """
+        if self.config.time_interval == "minute":
+            return (dt.toordinal() * 24 + dt.hour) * 60 + dt.minute
+        elif self.config.time_interval == "hour":
+            return dt.toordinal() * 24 + dt.hour
+        elif self.config.time_interval == "day":
+            return dt.toordinal()
+        elif self.config.time_interval == "week":
+            # Ordinals of Sundays are multiples of 7
+            return (dt.toordinal() - (dt.weekday() + 1) % 7) // 7
+        elif self.config.time_interval == "month":
+            return dt.year * 12 + dt.month - 1
+        elif self.config.time_interval == "year":
+            return dt.year
+        else:
+            raise ValueError("Unsupported time interval")
+
+    def bucket_index_to_datetime(self, index):
+        """
+        Get the start of the time bucket with the given index
+        
+        Parameters:
+            index (int): Bucket index as returned by get_bucket_index
+        
+        Returns:
+            datetime: The start of the time bucket
+        
+        Raises:
+            ValueError: If an unsupported time interval is specified
+        """
+        if self.config.time_interval == "minute":
+            hours, minute = divmod(index, 60)
+            ordinal, hour = divmod(hours, 24)
+            return datetime.fromordinal(ordinal).replace(hour=hour, minute=minute)
+        elif self.config.time_interval == "hour":
+            ordinal, hour = divmod(index, 24)
+            return datetime.fromordinal(ordinal).replace(hour=hour)
+        elif self.config.time_interval == "day":
+            return datetime.fromordinal(index)
+        elif self.config.time_interval == "week":
+            return datetime.fromordinal(index * 7)
+        elif self.config.time_interval == "month":
+            year, month = divmod(index, 12)
+            return datetime(year, month + 1, 1)
+        elif self.config.time_interval == "year":
+            return datetime(index, 1, 1)
+        else:
+            raise ValueError("Unsupported time interval")
+
+    def bucket_index_to_key(self, index):
+        """
+        Get the time key (as returned by get_time_key) of the bucket with the given index
+        
+        Parameters:
+            index (int): Bucket index
+        
+        Returns:
+            int: timestamp representing the start of the time bucket
+        """
+        return int(self.bucket_index_to_datetime(index).timestamp())
+
+    def format_bucket(self, index):
+        """
+        Format the start of a time bucket as an output timestamp string
+        
+        Parameters:
+            index (int): Bucket index
+        
+        Returns:
+            str: Timestamp string in the format YYYY-MM-DDTHH:MM:SS
+        """
+        return self.bucket_index_to_datetime(index).strftime("%Y-%m-%dT%H:%M:%S")
+
     def process_chunk(self, chunk):
         """
         Process a list of log lines and aggregate metrics per time bucket
-        Tracks total requests, error counts, most requested routes, and response code distribution
+        Tracks total requests, error counts, most requested routes, response code distribution
+        and distinct referrers and user agents
         
         Parameters:
             chunk (List[str]): List of log lines
@@ -67,44 +191,130 @@ class LogAggregator:
         Returns:
             dict: Aggregation dict:
                 {
-                    "time_aggregation": {
-                        <time_bucket_key>: {"total": int, "errors": int},
+                    "time_aggregation": DenseTimeSeries indexed by bucket index,
+                    "most_requested_routes": {<route>: count, ...},
+                    "response_code_distribution": {<code>: count, ...},
+                    "distinct_counts": {
+                        <bucket_index>: {"referrers": HyperLogLog, "user_agents": HyperLogLog},
                         ...
                     },
-                    "most_requested_routes": {<route>: count, ...},
-                    "response_code_distribution": {<code>: count, ...}
+                    "route_series": {<route>: DenseTimeSeries, ...},
+                    "status_class_series": {<status_class>: DenseTimeSeries, ...},
+                    "bucket_code_counts": {(<bucket_index>, <code>): count, ...} only filled when store_path is set
                 }
         """
-        aggregation = {
-            "time_aggregation": {},
-            "most_requested_routes": {},
-            "response_code_distribution": {}
-        }
+        aggregation = self.empty_aggregation()
 
         for line in chunk:
-            parts = line.strip().split()
-            if len(parts) < 4:
+            parsed = self.parse_line(line)
+            if parsed is None:
                 continue
 
-            timestamp, _, route, code = parts[:4]
-            key = self.get_time_key(timestamp)
-            code_int = int(code)
+            timestamp, route, code, referrer, user_agent = parsed
+            index = self.get_bucket_index(datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S"))
+            self.update_aggregation(aggregation, index, route, code, referrer, user_agent)
 
-            # Initialize the time bucket if necessary
-            if key not in aggregation["time_aggregation"]:
-                aggregation["time_aggregation"][key] = {"total": 0, "errors": 0}
+        return aggregation
 
-            aggregation["time_aggregation"][key]["total"] += 1
-            if self.http_codes.code_is_error(code_int):
-                aggregation["time_aggregation"][key]["errors"] += 1
+    def empty_aggregation(self):
+        """
+        Create an empty aggregation dict in the format returned by process_chunk
+        
+        Returns:
+            dict: The empty aggregation dict
+        """
+        return {
+            "time_aggregation": DenseTimeSeries(),
+            "most_requested_routes": {},
+            "response_code_distribution": {},
+            "distinct_counts": {},
+            "route_series": {},
+            "status_class_series": {},
+            "bucket_code_counts": {}
+        }
 
-            # Update most requested routes
-            aggregation["most_requested_routes"][route] = aggregation["most_requested_routes"].get(route, 0) + 1
+    def parse_line(self, line):
+        """
+        Split a log line into the fields used by the aggregation
+        
+        Parameters:
+            line (str): A single log line
+        
+        Returns:
+            tuple or None: (timestamp, route, code, referrer, user_agent) or None if the line is too short
+                referrer and user_agent are None when missing, the user agent may contain spaces
+        """
+        parts = line.strip().split()
+        if len(parts) < 4:
+            return None
 
-            # Update response code distribution
-            aggregation["response_code_distribution"][code] = aggregation["response_code_distribution"].get(code, 0) + 1
+        timestamp, _, route, code = parts[:4]
+        referrer = parts[5] if len(parts) > 5 else None
+        user_agent = " ".join(parts[6:]) if len(parts) > 6 else None
+        return timestamp, route, code, referrer, user_agent
 
-        return aggregation
+    def update_aggregation(self, aggregation, key, route, code, referrer=None, user_agent=None):
+        """
+        Count a single parsed log line into an aggregation dict in place
+        
+        Parameters:
+            aggregation (dict): Aggregation dict in the format returned by process_chunk
+            key (int): Time bucket index of the line
+            route (str): Requested route
+            code (str): HTTP status code
+            referrer (str, optional): Referrer URL
+            user_agent (str, optional): User agent, used as the client identity for unique client counts
+        """
+        code_int = int(code)
+
+        is_error = 1 if self.http_codes.code_is_error(code_int) else 0
+        aggregation["time_aggregation"].add(key, 1, is_error)
+
+        # Update the bucket x route and bucket x status class matrices
+        # Route series form a bounded candidate set ranked by the exact chunk counts of the routes
+        # Once it is full a route only replaces the least requested candidate if it has strictly more requests,
+        # so a run of one-off routes cannot push out a candidate and a route that misses requests is marked partial
+        route_series = aggregation["route_series"]
+        route_counts = aggregation["most_requested_routes"]
+        if route in route_series:
+            route_series[route].add(key, 1, is_error)
+        elif self.config.max_route_series:
+            admit = len(route_series) < self.route_series_capacity()
+            if not admit:
+                evicted = min(route_series, key=route_counts.get)
+                admit = route_counts.get(route, 0) + 1 > route_counts[evicted]
+                if admit:
+                    del route_series[evicted]
+            if admit:
+                route_series[route] = DenseTimeSeries()
+                route_series[route].add(key, 1, is_error)
+        status_class = self.http_codes.get_type_by_code(code_int)
+        if status_class is not None:
+            if status_class not in aggregation["status_class_series"]:
+                aggregation["status_class_series"][status_class] = DenseTimeSeries()
+            aggregation["status_class_series"][status_class].add(key, 1, is_error)
+        # Per bucket response codes are only needed by the time series store
+        if self.config.store_path:
+            bucket_code = (key, code)
+            aggregation["bucket_code_counts"][bucket_code] = aggregation["bucket_code_counts"].get(bucket_code, 0) + 1
+
+        # Update most requested routes
+        aggregation["most_requested_routes"][route] = aggregation["most_requested_routes"].get(route, 0) + 1
+
+        # Update response code distribution
+        aggregation["response_code_distribution"][code] = aggregation["response_code_distribution"].get(code, 0) + 1
+
+        # Update distinct referrer and user agent sketches
+        if referrer is not None or user_agent is not None:
+            if key not in aggregation["distinct_counts"]:
+                aggregation["distinct_counts"][key] = {
+                    "referrers": HyperLogLog(self.config.hll_error_rate),
+                    "user_agents": HyperLogLog(self.config.hll_error_rate)
+                }
+            if referrer is not None:
+                aggregation["distinct_counts"][key]["referrers"].add(referrer)
+            if user_agent is not None:
+                aggregation["distinct_counts"][key]["user_agents"].add(user_agent)
 
     def merge_aggregations(self, base, new):
         """
@@ -118,27 +328,105 @@ class LogAggregator:
             dict: The merged aggregation dictionary
         """
         # Merge time_aggregation
-        for ts, counts in new.get("time_aggregation", {}).items():
-            if ts not in base["time_aggregation"]:
-                base["time_aggregation"][ts] = counts
-            else:
-                base["time_aggregation"][ts]["total"] += counts["total"]
-                base["time_aggregation"][ts]["errors"] += counts["errors"]
+        if "time_aggregation" in new:
+            base["time_aggregation"].merge(new["time_aggregation"])
 
         # Merge most_requested_routes
         for route, count in new.get("most_requested_routes", {}).items():
             base["most_requested_routes"][route] = base["most_requested_routes"].get(route, 0) + count
 
+        # Route candidates are ranked by the merged route counts
+        self.merge_route_series(base, new)
+
         # Merge response_code_distribution
         for code, count in new.get("response_code_distribution", {}).items():
             base["response_code_distribution"][code] = base["response_code_distribution"].get(code, 0) + count
 
+        # Union the distinct count sketches
+        for ts, sketches in new.get("distinct_counts", {}).items():
+            if ts not in base["distinct_counts"]:
+                base["distinct_counts"][ts] = sketches
+            else:
+                base["distinct_counts"][ts]["referrers"].merge(sketches["referrers"])
+                base["distinct_counts"][ts]["user_agents"].merge(sketches["user_agents"])
+
+        # Merge the status class series
+        for status_class, series in new.get("status_class_series", {}).items():
+            if status_class not in base["status_class_series"]:
+                base["status_class_series"][status_class] = series
+            else:
+                base["status_class_series"][status_class].merge(series)
+
+        # Merge the per bucket response codes
+        for bucket_code, count in new.get("bucket_code_counts", {}).items():
+            base["bucket_code_counts"][bucket_code] = base["bucket_code_counts"].get(bucket_code, 0) + count
+
         return base
 
+    def route_series_capacity(self):
+        """
+        Get the maximum number of route series kept while building or merging aggregations
+        
+        Returns:
+            int: The capacity
+        """
+        return self.config.max_route_series * self.ROUTE_CANDIDATE_FACTOR
+
+    def merge_route_series(self, base, new):
+        """
+        Merge the route series of two aggregations in place and keep the most requested candidates
+        A route evicted from a candidate set somewhere misses those requests in its series, so its series is
+        only partial and spike detection scales it by its coverage of the route count
+        Must be called after most_requested_routes of new are added to base
+        
+        Parameters:
+            base (dict): Aggregation dict with "route_series" and "most_requested_routes", updated in place
+            new (dict): Aggregation dict with "route_series"
+        """
+        base_series = base["route_series"]
+        for route, series in new.get("route_series", {}).items():
+            if route in base_series:
+                base_series[route].merge(series)
+            else:
+                base_series[route] = series
+
+        capacity = self.route_series_capacity()
+        if len(base_series) > capacity:
+            route_counts = base["most_requested_routes"]
+            for route in sorted(base_series, key=route_counts.get)[:len(base_series) - capacity]:
+                del base_series[route]
+
+    def select_route_series(self, aggregated):
+        """
+        Pick the max_route_series most requested routes that have a series
+        Routes are ranked by "route_totals" if present, the request count of each route over the span of its
+        series, otherwise by the merged most_requested_routes
+        
+        Parameters:
+            aggregated (dict): Merged aggregation dict in the format returned by process_chunk
+        
+        Returns:
+            dict: {<route>: (DenseTimeSeries, coverage), ...} where coverage is the share of the route requests
+                found in the series
+        """
+        route_series = aggregated.get("route_series", {})
+        route_totals = aggregated.get("route_totals", aggregated.get("most_requested_routes", {}))
+        top_routes = sorted(route_series, key=lambda route: route_totals.get(route, 0), reverse=True)
+
+        selected = {}
+        for route in top_routes[:self.config.max_route_series]:
+            series = route_series[route]
+            series_total = series.sums()[0]
+            route_total = route_totals.get(route, 0)
+            selected[route] = (series, min(1.0, series_total / route_total) if route_total else 1.0)
+        return selected
+
     def aggregate(self):
         """
         Aggregate log data using multiprocessing
         Heavier on memory than multithreading, but multithreading in Python does not play well with heavy CPU load tasks
+        Failed or timed out chunks are retried and stragglers are re-executed, chunks that fail on every attempt or whose
+        result cannot be merged are reported
         
         Returns:
             dict: final aggregation data:
@@ -149,51 +437,314 @@ class LogAggregator:
                     },
                     "most_requested_routes": {<route>: count, ...},
                     "response_code_distribution": {<code>: count, ...},
-                    "spikes": {"requests": {...}, "errors": {...}} 
+                    "response_codes_per_bucket": {<timestamp_str>: {<code>: count, ...}, ...} if store_path is set,
+                    "distinct_counts": {
+                        <timestamp_str>: {"referrers": int, "user_agents": int},
+                        ...
+                    },
+                    "spikes": {"requests": {...}, "errors": {...}},
+                    "series_spikes": {
+                        "routes": {<route>: {"requests": {...}, "errors": {...}}, ...},
+                        "status_classes": {<status_class>: {...}, ...},
+                        "partial_routes": {<route>: coverage, ...}
+                    },
+                    "failed_chunks": [{"first_line": int, "line_count": int, "error": str}, ...],
+                    "chunk_stats": {
+                        "retries": int, "timeouts": int, "speculative": int, "duplicates_discarded": int,
+                        "pool_restarts": int
+                    }
                 }
         """
-        aggregated = {
-            "time_aggregation": {},
-            "most_requested_routes": {},
-            "response_code_distribution": {}
-        }
-        futures = []
+        aggregated = self.empty_aggregation()
+        # chunk_id -> (first_line, line_count)
+        chunk_lines = {}
 
-        with concurrent.futures.ProcessPoolExecutor(max_workers=self.config.max_workers) as executor:
+        scheduler = self._create_scheduler()
+        try:
             with open(self.config.file_path, "r") as f:
                 chunk = []
+                first_line = 1
                 for line in f:
                     chunk.append(line)
                     if len(chunk) >= self.config.chunk_size:
-                        futures.append(executor.submit(self.process_chunk, chunk))
+                        chunk_lines[scheduler.submit(self.process_chunk, chunk)] = (first_line, len(chunk))
+                        first_line += len(chunk)
                         chunk = []
                 if chunk:
-                    futures.append(executor.submit(self.process_chunk, chunk))
+                    chunk_lines[scheduler.submit(self.process_chunk, chunk)] = (first_line, len(chunk))
+
+            for chunk_id, result in scheduler.results():
+                try:
+                    aggregated = self.merge_aggregations(aggregated, result)
+                except Exception as e:
+                    #  Would pass this error to a logging class in a real life scenario
+                    print(f"Error merging aggregation: {e}")
+                    scheduler.reject(chunk_id, f"Merge failed: {e}")
+        finally:
+            # Workers still running an abandoned or timed out attempt are terminated instead of joined
+            scheduler.shutdown()
+
+        data = self.finalize(aggregated)
+        data["failed_chunks"] = [
+            {"first_line": chunk_lines[chunk_id][0], "line_count": chunk_lines[chunk_id][1], "error": error}
+            for chunk_id, error in sorted(scheduler.failed.items())
+        ]
+        data["chunk_stats"] = scheduler.stats
+        return data
 
-            for future in concurrent.futures.as_completed(futures):
+    def _create_scheduler(self):
+        return ChunkScheduler(
+            functools.partial(concurrent.futures.ProcessPoolExecutor, max_workers=self.config.max_workers),
+            self.config.max_workers,
+            max_retries=self.config.chunk_max_retries,
+            timeout=self.config.chunk_timeout,
+            speculation_threshold=self.config.speculation_threshold,
+            speculation_factor=self.config.speculation_factor
+        )
+
+    def aggregate_sample(self, fraction=None):
+        """
+        Estimate the aggregation from a random sample of newline aligned byte blocks of the log file
+        Counts are scaled up by block_count / blocks_read and reported with confidence intervals
+        Distinct counts are not scaled and only cover the sampled lines
+        
+        Parameters:
+            fraction (float, optional): Fraction of blocks to read, defaults to sample_fraction from the config
+        
+        Returns:
+            dict: final aggregation data in the format returned by aggregate, plus:
+                {
+                    "confidence_intervals": {
+                        "time_aggregation": {<timestamp_str>: {"total": (low, high), "errors": (low, high)}, ...},
+                        "most_requested_routes": {<route>: (low, high), ...},
+                        "response_code_distribution": {<code>: (low, high), ...}
+                    },
+                    "sample": {"blocks_read": int, "block_count": int, "confidence": float},
+                    "failed_chunks": [{"start": int, "end": int, "error": str}, ...],
+                    "chunk_stats": {...}
+                }
+                Interval bounds are None when fewer than two blocks were read, an empty estimate with the
+                failed_chunks is returned when no block could be read
+        """
+        # Intermediate estimates are skipped, each one would be a full finalize over scaled copies of every series
+        result = None
+        for result in self.iter_sample_estimates(fraction, update_every=0):
+            pass
+        return result
+
+    def iter_sample_estimates(self, fraction=None, update_every=None):
+        """
+        Progressively refine a sampled estimate, yielding a new estimate as more blocks are read
+        Reading with fraction 1 ends with the exact aggregation and zero width intervals
+        
+        Parameters:
+            fraction (float, optional): Fraction of blocks to read, defaults to sample_fraction from the config
+            update_every (int, optional): Blocks merged between estimates, defaults to max_workers, 0 only yields
+                the final estimate
+        
+        Yields:
+            dict: estimate in the format returned by aggregate_sample
+        """
+        fraction = fraction if fraction is not None else self.config.sample_fraction
+        if not 0 < fraction <= 1:
+            raise ValueError("fraction must be greater than 0 and at most 1")
+        update_every = update_every if update_every is not None else self.config.max_workers
+
+        block_size = self.config.sample_block_size
+        block_count = max(1, math.ceil(os.path.getsize(self.config.file_path) / block_size))
+        rng = random.Random(self.config.sample_seed) if self.config.sample_seed >= 0 else random.Random()
+        blocks = rng.sample(range(block_count), max(1, round(block_count * fraction)))
+
+        merged = self.empty_aggregation()
+        # Per metric sum of squares over the blocks read, the sums themselves live in merged
+        squares = {}
+        blocks_read = 0
+
+        scheduler = self._create_scheduler()
+        try:
+            block_ranges = {}
+            for block in blocks:
+                start, end = block * block_size, (block + 1) * block_size
+                block_ranges[scheduler.submit(self.process_block, start, end)] = (start, end)
+
+            for chunk_id, block_aggregation in scheduler.results():
                 try:
-                    aggregated = self.merge_aggregations(aggregated, future.result())
+                    metrics = list(self._block_metrics(block_aggregation))
+                    merged = self.merge_aggregations(merged, block_aggregation)
                 except Exception as e:
                     #  Would pass this error to a logging class in a real life scenario
                     print(f"Error merging aggregation: {e}")
+                    scheduler.reject(chunk_id, f"Merge failed: {e}")
+                    continue
+                for metric, value in metrics:
+                    squares[metric] = squares.get(metric, 0) + value * value
+                blocks_read += 1
+
+                if update_every and blocks_read % update_every == 0 and blocks_read < len(blocks):
+                    yield self._sample_estimate(merged, squares, blocks_read, block_count)
+
+            # Failed blocks only shrink the sample, the final estimate covers every block that was read
+            # If every block failed there is nothing to scale, so the estimate is empty
+            if blocks_read:
+                estimate = self._sample_estimate(merged, squares, blocks_read, block_count)
+            else:
+                estimate = self.finalize(self.empty_aggregation())
+                estimate["confidence_intervals"] = {
+                    "time_aggregation": {}, "most_requested_routes": {}, "response_code_distribution": {}
+                }
+                estimate["sample"] = {
+                    "blocks_read": 0,
+                    "block_count": block_count,
+                    "confidence": self.config.sample_confidence
+                }
+            estimate["failed_chunks"] = [
+                {"start": block_ranges[chunk_id][0], "end": block_ranges[chunk_id][1], "error": error}
+                for chunk_id, error in sorted(scheduler.failed.items())
+            ]
+            estimate["chunk_stats"] = scheduler.stats
+            yield estimate
+        finally:
+            scheduler.shutdown()
+
+    def process_block(self, start, end):
+        """
+        Process the lines that start inside a byte range of the log file
+        A line crossing the start offset belongs to the previous block, so every line is read by exactly one block
+        
+        Parameters:
+            start (int): Inclusive start byte offset
+            end (int): Exclusive end byte offset
+        
+        Returns:
+            dict: Aggregation dict in the format returned by process_chunk
+        """
+        lines = []
+        with open(self.config.file_path, "rb") as f:
+            position = start
+            if start > 0:
+                # Skip the rest of the line the previous block owns
+                f.seek(start - 1)
+                position = start - 1 + len(f.readline())
+            while position < end:
+                line = f.readline()
+                if not line:
+                    break
+                position += len(line)
+                lines.append(line.decode("utf-8", errors="replace"))
+        return self.process_chunk(lines)
+
+    def _block_metrics(self, aggregation):
+        # Flatten the counts of one block into (metric, value) pairs
+        for index, total, errors in aggregation["time_aggregation"].buckets():
+            yield ("total", index), total
+            yield ("errors", index), errors
+        for route, count in aggregation["most_requested_routes"].items():
+            yield ("route", route), count
+        for code, count in aggregation["response_code_distribution"].items():
+            yield ("code", code), count
+
+    def _sample_estimate(self, merged, squares, blocks_read, block_count):
+        factor = block_count / blocks_read
+        z = statistics.NormalDist().inv_cdf((1 + self.config.sample_confidence) / 2)
+
+        def interval(metric, observed):
+            if blocks_read < 2:
+                return (None, None)
+            # Variance of the per block totals, with the finite population correction for sampling without replacement
+            variance = max(0.0, (squares.get(metric, 0) - observed * observed / blocks_read) / (blocks_read - 1))
+            margin = z * block_count * math.sqrt((1 - blocks_read / block_count) * variance / blocks_read)
+            estimate = observed * factor
+            # Lines that were actually read are a hard lower bound
+            return (max(observed, round(estimate - margin)), round(estimate + margin))
+
+        data = self.finalize({
+            "time_aggregation": merged["time_aggregation"].scaled(factor),
+            "most_requested_routes": {
+                route: round(count * factor) for route, count in merged["most_requested_routes"].items()
+            },
+            "response_code_distribution": {
+                code: round(count * factor) for code, count in merged["response_code_distribution"].items()
+            },
+            "distinct_counts": merged["distinct_counts"],
+            "route_series": {route: series.scaled(factor) for route, series in merged["route_series"].items()},
+            "status_class_series": {
+                status_class: series.scaled(factor) for status_class, series in merged["status_class_series"].items()
+            },
+            "bucket_code_counts": {
+                bucket_code: round(count * factor) for bucket_code, count in merged["bucket_code_counts"].items()
+            }
+        })
 
-        # Sort the time buckets based on the sort order defined in the config
-        time_agg = aggregated.get("time_aggregation", {})
         reverse_sort = (self.config.sort_order.lower() == "desc")
-        sorted_time_items = sorted(time_agg.items(), key=lambda x: x[0], reverse=reverse_sort)
+        data["confidence_intervals"] = {
+            "time_aggregation": {
+                self.format_bucket(index): {
+                    "total": interval(("total", index), total),
+                    "errors": interval(("errors", index), errors)
+                }
+                for index, total, errors in merged["time_aggregation"].buckets(reverse_sort)
+            },
+            "most_requested_routes": {
+                route: interval(("route", route), count) for route, count in merged["most_requested_routes"].items()
+            },
+            "response_code_distribution": {
+                code: interval(("code", code), count) for code, count in merged["response_code_distribution"].items()
+            }
+        }
+        data["sample"] = {
+            "blocks_read": blocks_read,
+            "block_count": block_count,
+            "confidence": self.config.sample_confidence
+        }
+        return data
 
-        sorted_time_agg = {
-            datetime.fromtimestamp(ts).strftime("%Y-%m-%dT%H:%M:%S"): data
-            for ts, data in sorted_time_items
+    def finalize(self, aggregated):
+        """
+        Store merged aggregation data and run spike detection on it
+        The time series stays in its dense form until here, timestamp strings are only created for the output
+        
+        Parameters:
+            aggregated (dict): Merged aggregation dict in the format returned by process_chunk
+        
+        Returns:
+            dict: final aggregation data in the format returned by aggregate
+        """
+        self._time_series = aggregated.get("time_aggregation", DenseTimeSeries())
+        self._route_series = self.select_route_series(aggregated)
+        self._status_class_series = aggregated.get("status_class_series", {})
+        reverse_sort = (self.config.sort_order.lower() == "desc")
+
+        # Estimates are computed once per bucket at output time
+        distinct_counts = aggregated.get("distinct_counts", {})
+        sorted_distinct_counts = {
+            self.format_bucket(index): {
+                "referrers": distinct_counts[index]["referrers"].count(),
+                "user_agents": distinct_counts[index]["user_agents"].count()
+            }
+            for index in sorted(distinct_counts, reverse=reverse_sort)
         }
 
+        codes_per_bucket = {}
+        for (index, code), count in aggregated.get("bucket_code_counts", {}).items():
+            codes_per_bucket.setdefault(index, {})[code] = count
+
+        # The dense series is already ordered by bucket, the sort order only picks the iteration direction
         self._aggregated_data = {
-            "time_aggregation": sorted_time_agg,
+            "time_aggregation": {
+                self.format_bucket(index): {"total": total, "errors": errors}
+                for index, total, errors in self._time_series.buckets(reverse_sort)
+            },
             "most_requested_routes": aggregated["most_requested_routes"],
-            "response_code_distribution": aggregated["response_code_distribution"]
+            "response_code_distribution": aggregated["response_code_distribution"],
+            "response_codes_per_bucket": {
+                self.format_bucket(index): codes_per_bucket[index]
+                for index in sorted(codes_per_bucket, reverse=reverse_sort)
+            },
+            "distinct_counts": sorted_distinct_counts
         }
 
         self.detect_spikes()
+        self.detect_series_spikes()
         return self._aggregated_data
 
     def detect_spikes(self):
@@ -217,33 +768,127 @@ class LogAggregator:
             ValueError: If no aggregated data is available
         """
 
-        time_agg = self._aggregated_data.get("time_aggregation", {})
-        if not time_agg:
+        # Averages are taken over the buckets that have requests, the zero padding of the arrays is skipped
+        bucket_count = self._time_series.bucket_count()
+        if not bucket_count:
             return {}
 
-        total_requests = [data.get("total", 0) for data in time_agg.values()]
-        total_errors = [data.get("errors", 0) for data in time_agg.values()]
+        total_requests, total_errors = self._time_series.sums()
+        request_average = total_requests / bucket_count
+        error_average = total_errors / bucket_count
 
-        if not total_requests:
-            return {}
-
-        request_average = statistics.mean(total_requests)
-        error_average = statistics.mean(total_errors) if any(total_errors) else 0
+        request_limit = request_average * self.config.timing_spike_threshold
+        error_limit = error_average * self.config.error_spike_threshold
+        reverse_sort = (self.config.sort_order.lower() == "desc")
 
         spikes = {"requests": {}, "errors": {}}
 
-        for time_bucket, data in time_agg.items():
-            total = data.get("total", 0)
-            errors = data.get("errors", 0)
-
-            if total > request_average * self.config.timing_spike_threshold:
-                spikes["requests"][time_bucket] = total
-            if errors > error_average * self.config.error_spike_threshold:
-                spikes["errors"][time_bucket] = errors
+        # Only the buckets reported as spikes get formatted
+        for index, total, errors in self._time_series.buckets(reverse_sort):
+            if total > request_limit:
+                spikes["requests"][self.format_bucket(index)] = total
+            if errors > error_limit:
+                spikes["errors"][self.format_bucket(index)] = errors
 
         self._aggregated_data["spikes"] = spikes
         return spikes
 
+    def detect_series_spikes(self):
+        """
+        Detect spikes in every route series (requests and errors) and every status class series in a single pass
+        All series are rows of one segmented bucket matrix, each row segment is compared against the row limit with
+        a single map over the int64 array instead of a Python loop per bucket
+        
+        Returns:
+            dict: spike data:
+                {
+                    "routes": {
+                        <route>: {"requests": {<timestamp_str>: int, ...}, "errors": {<timestamp_str>: int, ...}},
+                        ...
+                    },
+                    "status_classes": {
+                        <status_class>: {<timestamp_str>: int, ...},
+                        ...
+                    },
+                    "partial_routes": {<route>: coverage, ...}
+                }
+                partial_routes lists the reported routes whose series missed some of their requests, their spike values
+                are lower bounds of the real bucket counts
+        """
+        series_spikes = {"routes": {}, "status_classes": {}, "partial_routes": {}}
+        self._aggregated_data["series_spikes"] = series_spikes
+
+        bucket_count = self._time_series.bucket_count()
+        if not bucket_count:
+            return series_spikes
+
+        # Each row is (output dict, series, column, coverage), column 0 holds totals and 1 holds errors
+        rows = []
+        for route, (series, coverage) in self._route_series.items():
+            route_spikes = series_spikes["routes"].setdefault(route, {"requests": {}, "errors": {}})
+            rows.append((route_spikes["requests"], series, 0, coverage))
+            rows.append((route_spikes["errors"], series, 1, coverage))
+        for status_class, series in self._status_class_series.items():
+            rows.append((series_spikes["status_classes"].setdefault(status_class, {}), series, 0, 1.0))
+
+        # A bucket without traffic on one route still counts towards its average
+        # Averages of partial route series are scaled up to the full route count, so a missing bucket can only hide
+        # a spike and never cause one
+        limits = [
+            self.series_spike_limit(series.sums()[column], bucket_count, coverage)
+            for _, series, column, coverage in rows
+        ]
+
+        reverse_sort = (self.config.sort_order.lower() == "desc")
+        positions = range(DenseTimeSeries.SEGMENT_SIZE)
+        for segment_id in self._time_series.segment_ids(reverse_sort):
+            base = segment_id * DenseTimeSeries.SEGMENT_SIZE
+            # Only the buckets reported as spikes get formatted, once for all rows
+            time_keys = {}
+            for (spikes, series, column, _), limit in zip(rows, limits):
+                segment = series.segments.get(segment_id)
+                if segment is None:
+                    continue
+                counts = segment[column]
+                # The limit is never negative, so a hit always lies in a bucket with traffic
+                hits = list(compress(positions, map(limit.__lt__, counts)))
+                if reverse_sort:
+                    hits.reverse()
+                for position in hits:
+                    if position not in time_keys:
+                        time_keys[position] = self.format_bucket(base + position)
+                    spikes[time_keys[position]] = counts[position]
+
+        # Only report the series that spiked
+        series_spikes["routes"] = {
+            route: spikes for route, spikes in series_spikes["routes"].items()
+            if spikes["requests"] or spikes["errors"]
+        }
+        series_spikes["status_classes"] = {
+            status_class: spikes for status_class, spikes in series_spikes["status_classes"].items() if spikes
+        }
+        series_spikes["partial_routes"] = {
+            route: round(self._route_series[route][1], 4) for route in series_spikes["routes"]
+            if self._route_series[route][1] < 1
+        }
+        self._aggregated_data["series_spikes"] = series_spikes
+        return series_spikes
+
+    def series_spike_limit(self, series_total, bucket_count, coverage=1.0):
+        """
+        Get the count a bucket of a route or status class series has to exceed to be reported as a spike
+        
+        Parameters:
+            series_total (int): Requests or errors of the series over all buckets
+            bucket_count (int): Number of buckets with traffic on any route
+            coverage (float): Share of the route requests found in the series, partial series are scaled up
+        
+        Returns:
+            float: The limit, never negative
+        """
+        return float(max(series_total / coverage / bucket_count * self.config.series_spike_threshold,
+                         self.config.series_spike_min_count - 1, 0))
+
     @property
     def data(self):
         """
@@ -0,0 +1,419 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from classes.dense_time_series import DenseTimeSeries
+
+class _UdpLogProtocol(asyncio.DatagramProtocol):
+    """
+    Datagram protocol that pushes every line of a received datagram onto the ingestion queue
+    UDP senders cannot be slowed down, so lines are dropped and counted when the queue is full
+    """
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        for line in data.decode("utf-8", errors="replace").splitlines():
+            self.server._enqueue_nowait(line)
+
+
+class LogIngestionServer:
+    """
+    Receives log lines over TCP/UDP and aggregates them into event-time windows
+    Windows are keyed by LogAggregator.get_bucket_index and closed once the watermark passes them
+    """
+    # Routes with a recent gap in their series that are remembered, as a multiple of the route series capacity
+    ROUTE_HOLE_LIMIT_FACTOR = 8
+
+    def __init__(self, aggregator, on_window_closed=None, store=None):
+        """
+        Initialize the LogIngestionServer class
+
+        Parameters:
+            aggregator (LogAggregator): Aggregator used for parsing, bucketing and spike detection
+            on_window_closed (callable, optional): Called as on_window_closed(key, window, spikes) for every closed window
+                where key is the bucket start as returned by LogAggregator.get_time_key
+            store (TimeSeriesStore, optional): Store every closed window is appended to, while serving the appends run
+                in a worker thread so the fsyncs do not block the event loop
+        """
+        self.aggregator = aggregator
+        self.config = aggregator.config
+        self.on_window_closed = on_window_closed
+        self.store = store
+
+        # Open windows keyed by bucket index, each one in the format returned by process_chunk
+        self._open_windows = {}
+        # Bounded history of closed (total, errors) buckets used for spike detection
+        self._closed_buckets = OrderedDict()
+        self._closed_distinct_counts = OrderedDict()
+        self._closed_series = {"route_series": {}, "status_class_series": {}}
+        # route -> newest closed bucket in which the route was counted without a series
+        self._route_holes = OrderedDict()
+        # (total, errors) summed over the closed buckets, kept up to date so closing a window never rescans them
+        self._closed_sums = [0, 0]
+        self._most_requested_routes = {}
+        self._response_code_distribution = {}
+        self._last_closed_key = None
+        self._watermark_key = None
+        self._data = None
+        self.watermark = None
+        # Spikes of the closed buckets, each bucket is checked once when its window closes
+        self.spikes = {"requests": {}, "errors": {}}
+        self.series_spikes = {"routes": {}, "status_classes": {}, "partial_routes": {}}
+
+        self.stats = {"ingested": 0, "malformed": 0, "late": 0, "dropped": 0, "windows_closed": 0}
+
+        self._queue = None
+        self._tcp_server = None
+        self._tcp_clients = set()
+        self._udp_transport = None
+        self._consumer = None
+        # Closed windows waiting to be appended to the store and the task writing them
+        self._store_backlog = []
+        self._store_task = None
+        self.tcp_port = None
+        self.udp_port = None
+
+    async def start(self):
+        """
+        Start the TCP and UDP listeners and the consumer task
+        Port 0 in the config binds an ephemeral port, the bound ports are stored on tcp_port and udp_port
+        """
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.config.ingest_queue_size)
+
+        self._tcp_server = await asyncio.start_server(
+            self._handle_tcp_client, self.config.ingest_host, self.config.ingest_tcp_port
+        )
+        self.tcp_port = self._tcp_server.sockets[0].getsockname()[1]
+
+        self._udp_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _UdpLogProtocol(self), local_addr=(self.config.ingest_host, self.config.ingest_udp_port)
+        )
+        self.udp_port = self._udp_transport.get_extra_info("sockname")[1]
+
+        self._consumer = asyncio.create_task(self._consume())
+
+    async def stop(self):
+        """
+        Stop the listeners, process the queued lines and close all remaining windows
+        """
+        if self._tcp_server is not None:
+            self._tcp_server.close()
+            # wait_closed also waits for connected clients, so they are disconnected here
+            for writer in list(self._tcp_clients):
+                writer.close()
+            await self._tcp_server.wait_closed()
+        if self._udp_transport is not None:
+            self._udp_transport.close()
+        if self._consumer is not None:
+            await self._queue.join()
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+        self.flush()
+        if self._store_task is not None:
+            await self._store_task
+
+    async def serve_forever(self):
+        """
+        Start the server and run until cancelled
+        """
+        await self.start()
+        try:
+            await self._tcp_server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle_tcp_client(self, reader, writer):
+        # Awaiting put applies backpressure to the sender once the queue is full
+        self._tcp_clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self._queue.put(line.decode("utf-8", errors="replace"))
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            self.stats["malformed"] += 1
+        finally:
+            self._tcp_clients.discard(writer)
+            writer.close()
+
+    def _enqueue_nowait(self, line):
+        try:
+            self._queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    async def _consume(self):
+        while True:
+            line = await self._queue.get()
+            try:
+                self.ingest_line(line)
+            except Exception as e:
+                #  Would pass this error to a logging class in a real life scenario
+                print(f"Error ingesting line: {e}")
+            finally:
+                self._queue.task_done()
+
+    def ingest_line(self, line):
+        """
+        Add a single log line to its event-time window and advance the watermark
+        Lines older than the bucket of the watermark or belonging to an already closed window are counted as late
+        and dropped, lines more than max_event_time_skew seconds ahead of the wall clock are counted as malformed
+
+        Parameters:
+            line (str): A single log line
+        """
+        parsed = self.aggregator.parse_line(line)
+        if parsed is None:
+            self.stats["malformed"] += 1
+            return
+
+        timestamp, route, code, referrer, user_agent = parsed
+        try:
+            dt = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
+            int(code)
+        except ValueError:
+            self.stats["malformed"] += 1
+            return
+
+        # A single line from a skewed clock would otherwise move the watermark far ahead and make every later line late
+        event_time = int(dt.timestamp())
+        if event_time > time.time() + self.config.max_event_time_skew:
+            self.stats["malformed"] += 1
+            return
+
+        key = self.aggregator.get_bucket_index(dt)
+        if ((self._watermark_key is not None and key < self._watermark_key)
+                or (self._last_closed_key is not None and key <= self._last_closed_key)):
+            self.stats["late"] += 1
+            return
+
+        if key not in self._open_windows:
+            self._open_windows[key] = self.aggregator.empty_aggregation()
+        self.aggregator.update_aggregation(self._open_windows[key], key, route, code, referrer, user_agent)
+        self.stats["ingested"] += 1
+
+        candidate = event_time - self.config.allowed_lateness
+        if self.watermark is None or candidate > self.watermark:
+            self.watermark = candidate
+            self._watermark_key = self.aggregator.get_bucket_index(datetime.fromtimestamp(self.watermark))
+            self._close_windows(self._watermark_key)
+
+        # Force the oldest windows closed to keep memory bounded under out-of-order floods
+        while len(self._open_windows) > self.config.max_open_windows:
+            self._close_window(min(self._open_windows))
+
+    def flush(self):
+        """
+        Close every open window regardless of the watermark
+        """
+        for key in sorted(self._open_windows):
+            self._close_window(key)
+
+    def _close_windows(self, watermark_key):
+        # A window is complete once the watermark has moved into a later bucket
+        for key in sorted(k for k in self._open_windows if k < watermark_key):
+            self._close_window(key)
+
+    def _close_window(self, key):
+        window = self._open_windows.pop(key)
+        self._last_closed_key = key if self._last_closed_key is None else max(self._last_closed_key, key)
+        time_key = self.aggregator.format_bucket(key)
+
+        total, errors = window["time_aggregation"].get(key)
+        self._closed_buckets[key] = (total, errors)
+        self._closed_sums[0] += total
+        self._closed_sums[1] += errors
+        while len(self._closed_buckets) > self.config.max_closed_windows:
+            self._evict_bucket()
+        if key in window["distinct_counts"]:
+            self._closed_distinct_counts[key] = window["distinct_counts"][key]
+
+        # Route and status class series share the retention of the closed buckets
+        self._merge_route_series(key, window)
+        for status_class, series in window["status_class_series"].items():
+            self._closed_series["status_class_series"].setdefault(status_class, DenseTimeSeries()).merge(series)
+        oldest_key = next(iter(self._closed_buckets))
+        for closed_series in self._closed_series.values():
+            for name in list(closed_series):
+                closed_series[name].trim(oldest_key)
+                if closed_series[name].is_empty():
+                    del closed_series[name]
+
+        self._add_counts(self._most_requested_routes, window["most_requested_routes"])
+        self._add_counts(self._response_code_distribution, window["response_code_distribution"])
+
+        self._detect_window_spikes(key, time_key, total, errors)
+        self._data = None
+        self.stats["windows_closed"] += 1
+
+        if self.store is not None:
+            distinct_counts = {}
+            if key in window["distinct_counts"]:
+                distinct_counts[time_key] = {
+                    "referrers": window["distinct_counts"][key]["referrers"].count(),
+                    "user_agents": window["distinct_counts"][key]["user_agents"].count()
+                }
+            self._store_backlog.append({
+                "time_aggregation": {time_key: {"total": total, "errors": errors}},
+                "response_codes_per_bucket": {time_key: dict(window["response_code_distribution"])},
+                "distinct_counts": distinct_counts,
+                "spikes": {
+                    spike_type: {time_key: spike_data[time_key]} if time_key in spike_data else {}
+                    for spike_type, spike_data in self.spikes.items()
+                }
+            })
+            self._schedule_store_write()
+
+        if self.on_window_closed is not None:
+            self.on_window_closed(self.aggregator.bucket_index_to_key(key), window, self.spikes)
+
+    def _schedule_store_write(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not serving, e.g. ingest_line and flush called directly, so nothing is blocked by writing in place
+            self._write_store_batch(self._take_store_batch())
+            return
+        if self._store_task is None or self._store_task.done():
+            self._store_task = loop.create_task(self._store_writer())
+
+    async def _store_writer(self):
+        # A single writer keeps the appends in window order, windows closed during a write go into the next batch
+        while self._store_backlog:
+            await asyncio.to_thread(self._write_store_batch, self._take_store_batch())
+
+    def _take_store_batch(self):
+        batch, self._store_backlog = self._store_backlog, []
+        return batch
+
+    def _write_store_batch(self, batch):
+        # The closed windows of a batch are appended as one segment, so one set of fsyncs covers all of them
+        data = {"time_aggregation": {}, "response_codes_per_bucket": {}, "distinct_counts": {}, "spikes": {}}
+        for window_data in batch:
+            for name in ("time_aggregation", "response_codes_per_bucket", "distinct_counts"):
+                data[name].update(window_data[name])
+            for spike_type, spike_data in window_data["spikes"].items():
+                data["spikes"].setdefault(spike_type, {}).update(spike_data)
+        try:
+            self.store.append(data)
+        except Exception as e:
+            #  Would pass this error to a logging class in a real life scenario
+            print(f"Error appending to time series store: {e}")
+
+    def _evict_bucket(self):
+        key, (total, errors) = self._closed_buckets.popitem(last=False)
+        self._closed_sums[0] -= total
+        self._closed_sums[1] -= errors
+        self._closed_distinct_counts.pop(key, None)
+
+        time_key = self.aggregator.format_bucket(key)
+        for spike_data in self.spikes.values():
+            spike_data.pop(time_key, None)
+        for route in list(self.series_spikes["routes"]):
+            route_spikes = self.series_spikes["routes"][route]
+            route_spikes["requests"].pop(time_key, None)
+            route_spikes["errors"].pop(time_key, None)
+            if not route_spikes["requests"] and not route_spikes["errors"]:
+                del self.series_spikes["routes"][route]
+        for status_class in list(self.series_spikes["status_classes"]):
+            self.series_spikes["status_classes"][status_class].pop(time_key, None)
+            if not self.series_spikes["status_classes"][status_class]:
+                del self.series_spikes["status_classes"][status_class]
+
+    def _add_counts(self, counts, new_counts):
+        # Counts are approximate once the least requested keys start getting dropped
+        limit = self.config.ingest_max_tracked_keys
+        for name, count in new_counts.items():
+            counts[name] = counts.get(name, 0) + count
+        if len(counts) > limit:
+            keep = sorted(counts, key=counts.get, reverse=True)[:max(1, limit // 2)]
+            kept = {name: counts[name] for name in keep}
+            counts.clear()
+            counts.update(kept)
+
+    def _detect_window_spikes(self, key, time_key, total, errors):
+        # Same rules as LogAggregator.detect_spikes and detect_series_spikes, applied to the closed bucket only
+        bucket_count = len(self._closed_buckets)
+        total_requests, total_errors = self._closed_sums
+        if total > total_requests / bucket_count * self.config.timing_spike_threshold:
+            self.spikes["requests"][time_key] = total
+        if errors > total_errors / bucket_count * self.config.error_spike_threshold:
+            self.spikes["errors"][time_key] = errors
+
+        route_series = self._closed_series["route_series"]
+        selected = self.aggregator.select_route_series({
+            "route_series": route_series,
+            "route_totals": {route: series.sums()[0] for route, series in route_series.items()}
+        })
+        for route, (series, coverage) in selected.items():
+            counts = series.get(key)
+            if counts is None:
+                continue
+            series_totals = series.sums()
+            for column, spike_type in enumerate(("requests", "errors")):
+                if counts[column] > self.aggregator.series_spike_limit(series_totals[column], bucket_count, coverage):
+                    route_spikes = self.series_spikes["routes"].setdefault(route, {"requests": {}, "errors": {}})
+                    route_spikes[spike_type][time_key] = counts[column]
+
+        for status_class, series in self._closed_series["status_class_series"].items():
+            counts = series.get(key)
+            if counts is not None and counts[0] > self.aggregator.series_spike_limit(series.sums()[0], bucket_count):
+                self.series_spikes["status_classes"].setdefault(status_class, {})[time_key] = counts[0]
+
+    def _merge_route_series(self, key, window):
+        # A route series must not have gaps inside the retained history, otherwise its average drops and it spikes falsely
+        closed_routes = self._closed_series["route_series"]
+        window_series = window["route_series"]
+        oldest_key = next(iter(self._closed_buckets))
+        capacity = self.aggregator.route_series_capacity()
+
+        for route in window["most_requested_routes"]:
+            series = window_series.get(route)
+            if series is not None and route in closed_routes:
+                closed_routes[route].merge(series)
+            elif (series is not None and len(closed_routes) < capacity
+                    and self._route_holes.get(route, oldest_key - 1) < oldest_key):
+                self._route_holes.pop(route, None)
+                closed_routes[route] = DenseTimeSeries().merge(series)
+            else:
+                closed_routes.pop(route, None)
+                self._route_holes[route] = key
+                self._route_holes.move_to_end(route)
+
+        # Forget holes that left the retained history and keep the rest bounded
+        while self._route_holes and next(iter(self._route_holes.values())) < oldest_key:
+            self._route_holes.popitem(last=False)
+        while len(self._route_holes) > capacity * self.ROUTE_HOLE_LIMIT_FACTOR:
+            self._route_holes.popitem(last=False)
+
+    @property
+    def data(self):
+        """
+        Get the aggregated data of the closed windows
+        Built on first access after a window closed, with spike detection rerun over the whole retained history
+
+        Returns:
+            dict: The aggregated log data in the format returned by LogAggregator.aggregate
+        """
+        if self._data is None:
+            time_series = DenseTimeSeries()
+            for index, (total, errors) in self._closed_buckets.items():
+                time_series.add(index, total, errors)
+            route_series = self._closed_series["route_series"]
+            self._data = self.aggregator.finalize({
+                "time_aggregation": time_series,
+                "most_requested_routes": dict(self._most_requested_routes),
+                "response_code_distribution": dict(self._response_code_distribution),
+                "distinct_counts": dict(self._closed_distinct_counts),
+                "route_series": dict(route_series),
+                # Closed route series have no gaps within the retained buckets
+                "route_totals": {route: series.sums()[0] for route, series in route_series.items()},
+                "status_class_series": dict(self._closed_series["status_class_series"])
+            })
+        return self._data
@@ -0,0 +1,242 @@
+import mmap
+import os
+import struct
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+class TimeSeriesStore:
+    """
+    Append-only on-disk store for aggregation results
+    Every append writes one segment of fixed-width records sorted by bucket, range reads use mmap
+    and binary search inside every segment overlapping the requested range, so opening the store reads nothing
+    """
+    MAGIC = b"LAGTS"
+    VERSION = 2
+    HEADER = struct.Struct("<5sBH")
+    # (bucket_ts, total, errors, referrers, user_agents, request_spike, error_spike)
+    BUCKET_RECORD = struct.Struct("<qqqIIBB6x")
+    # (bucket_ts, code, count)
+    CODE_RECORD = struct.Struct("<qH6xq")
+    # (first_bucket_record, bucket_count, first_code_record, code_count, min_ts, max_ts)
+    SEGMENT_RECORD = struct.Struct("<qqqqqq")
+    TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+    def __init__(self, directory):
+        """
+        Initialize the TimeSeriesStore class, creating the store files if needed
+
+        Parameters:
+            directory (str): Directory holding the store files
+
+        Raises:
+            ValueError: If an existing store file has an unexpected format
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._paths = {
+            "buckets": os.path.join(directory, "buckets.dat"),
+            "codes": os.path.join(directory, "codes.dat"),
+            "segments": os.path.join(directory, "segments.dat")
+        }
+        self._record_structs = {
+            "buckets": self.BUCKET_RECORD,
+            "codes": self.CODE_RECORD,
+            "segments": self.SEGMENT_RECORD
+        }
+        for name, path in self._paths.items():
+            self._init_file(path, self._record_structs[name].size)
+
+    def _init_file(self, path, record_size):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, record_size))
+            return
+        with open(path, "rb") as f:
+            header = f.read(self.HEADER.size)
+        if len(header) != self.HEADER.size or self.HEADER.unpack(header) != (self.MAGIC, self.VERSION, record_size):
+            raise ValueError(f"Unsupported time series store file: {path}")
+
+    def _record_count(self, name):
+        # A partially written trailing record from an interrupted append is ignored
+        size = os.path.getsize(self._paths[name]) - self.HEADER.size
+        return size // self._record_structs[name].size
+
+    def append(self, data):
+        """
+        Append the buckets of an aggregation result as a new segment
+        The segment index record is written last, so an interrupted append leaves no visible partial segment
+
+        Parameters:
+            data (dict): Aggregation data in the format returned by LogAggregator.aggregate
+        """
+        time_agg = data.get("time_aggregation", {})
+        if not time_agg:
+            return
+        distinct_counts = data.get("distinct_counts", {})
+        spikes = data.get("spikes", {})
+        request_spikes = spikes.get("requests", {})
+        error_spikes = spikes.get("errors", {})
+
+        rows = []
+        for time_key, counts in time_agg.items():
+            distinct = distinct_counts.get(time_key, {})
+            rows.append(self.BUCKET_RECORD.pack(
+                self._to_epoch(time_key),
+                counts["total"],
+                counts["errors"],
+                distinct.get("referrers", 0),
+                distinct.get("user_agents", 0),
+                time_key in request_spikes,
+                time_key in error_spikes
+            ))
+        rows.sort(key=lambda row: self.BUCKET_RECORD.unpack(row)[0])
+        min_ts = self.BUCKET_RECORD.unpack(rows[0])[0]
+        max_ts = self.BUCKET_RECORD.unpack(rows[-1])[0]
+
+        code_rows = []
+        for time_key, codes in data.get("response_codes_per_bucket", {}).items():
+            if time_key in time_agg:
+                bucket_ts = self._to_epoch(time_key)
+                code_rows.extend((bucket_ts, int(code), count) for code, count in codes.items())
+        code_rows = [self.CODE_RECORD.pack(*row) for row in sorted(code_rows)]
+
+        first_bucket = self._truncate_partial("buckets")
+        first_code = self._truncate_partial("codes")
+        self._write("buckets", b"".join(rows))
+        self._write("codes", b"".join(code_rows))
+        self._truncate_partial("segments")
+        self._write("segments", self.SEGMENT_RECORD.pack(
+            first_bucket, len(rows), first_code, len(code_rows), min_ts, max_ts
+        ))
+
+    def _truncate_partial(self, name):
+        count = self._record_count(name)
+        with open(self._paths[name], "r+b") as f:
+            f.truncate(self.HEADER.size + count * self._record_structs[name].size)
+        return count
+
+    def _write(self, name, payload):
+        with open(self._paths[name], "ab") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_range(self, start=None, end=None, sort_order="asc"):
+        """
+        Read the stored buckets in a time range without re-aggregating raw logs
+        When a bucket was appended more than once (e.g. a follow-mode tick updating an open bucket) the latest append wins
+
+        Parameters:
+            start (int, optional): Inclusive start bucket timestamp
+            end (int, optional): Inclusive end bucket timestamp
+            sort_order (str): "asc" or "desc"
+
+        Returns:
+            dict: Aggregation data in the format returned by LogAggregator.aggregate
+                response_code_distribution sums the stored code counts of the returned buckets
+        """
+        start = start if start is not None else -2 ** 63
+        end = end if end is not None else 2 ** 63 - 1
+
+        segments = list(self._iter_records("segments", 0, self._record_count("segments")))
+        overlapping = [segment for segment in segments if segment[4] <= end and segment[5] >= start]
+
+        buckets = {}
+        # bucket_ts -> {code: count}, replaced together with the bucket by a later append
+        bucket_codes = {}
+        if overlapping:
+            with self._map("buckets") as bucket_map, self._map("codes") as code_map:
+                for first_bucket, bucket_count, first_code, code_count, _, _ in overlapping:
+                    view = _RecordView(bucket_map, self.HEADER.size, self.BUCKET_RECORD, first_bucket, bucket_count)
+                    lo = bisect_left(view, start)
+                    hi = bisect_right(view, end)
+                    for i in range(lo, hi):
+                        record = self.BUCKET_RECORD.unpack_from(bucket_map, view.offset(i))
+                        buckets[record[0]] = record
+                        bucket_codes[record[0]] = {}
+
+                    view = _RecordView(code_map, self.HEADER.size, self.CODE_RECORD, first_code, code_count)
+                    lo = bisect_left(view, start)
+                    hi = bisect_right(view, end)
+                    for i in range(lo, hi):
+                        bucket_ts, code, count = self.CODE_RECORD.unpack_from(code_map, view.offset(i))
+                        bucket_codes[bucket_ts][str(code)] = count
+
+        result = {
+            "time_aggregation": {},
+            "most_requested_routes": {},
+            "response_code_distribution": {},
+            "response_codes_per_bucket": {},
+            "distinct_counts": {},
+            "spikes": {"requests": {}, "errors": {}}
+        }
+        for ts in sorted(buckets, reverse=(sort_order == "desc")):
+            _, total, errors, referrers, user_agents, request_spike, error_spike = buckets[ts]
+            time_key = datetime.fromtimestamp(ts).strftime(self.TIMESTAMP_FORMAT)
+            result["time_aggregation"][time_key] = {"total": total, "errors": errors}
+            result["response_codes_per_bucket"][time_key] = bucket_codes[ts]
+            for code, count in bucket_codes[ts].items():
+                result["response_code_distribution"][code] = result["response_code_distribution"].get(code, 0) + count
+            result["distinct_counts"][time_key] = {"referrers": referrers, "user_agents": user_agents}
+            if request_spike:
+                result["spikes"]["requests"][time_key] = total
+            if error_spike:
+                result["spikes"]["errors"][time_key] = errors
+        return result
+
+    def _iter_records(self, name, first, count):
+        if count == 0:
+            return
+        record_struct = self._record_structs[name]
+        with self._map(name) as mapped:
+            for i in range(first, first + count):
+                yield record_struct.unpack_from(mapped, self.HEADER.size + i * record_struct.size)
+
+    def _map(self, name):
+        f = open(self._paths[name], "rb")
+        try:
+            return _MappedFile(f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except Exception:
+            f.close()
+            raise
+
+    def _to_epoch(self, time_key):
+        return int(datetime.strptime(time_key, self.TIMESTAMP_FORMAT).timestamp())
+
+
+class _MappedFile:
+    """
+    Context manager closing both an mmap and its file
+    """
+    def __init__(self, file, mapped):
+        self.file = file
+        self.mapped = mapped
+
+    def __enter__(self):
+        return self.mapped
+
+    def __exit__(self, *exc):
+        self.mapped.close()
+        self.file.close()
+
+
+class _RecordView:
+    """
+    Sequence of the bucket timestamps of the bucket or code records of one segment, used for binary search over the
+    mmap without copying
+    """
+    def __init__(self, mapped, header_size, record_struct, first, count):
+        self.mapped = mapped
+        self.header_size = header_size
+        self.record_struct = record_struct
+        self.first = first
+        self.count = count
+
+    def offset(self, i):
+        return self.header_size + (self.first + i) * self.record_struct.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return struct.unpack_from("<q", self.mapped, self.offset(i))[0]
@@ -1,5 +1,6 @@
 from classes.log_generator import LogGenerator
 from classes.log_aggregator import LogAggregator
+from classes.time_series_store import TimeSeriesStore
 
 if __name__ == "__main__":
     # Comment out the follwing 2 lines if you don't need a new log file
@@ -10,6 +11,13 @@ if __name__ == "__main__":
     aggregator.aggregate()
 
     insights = aggregator.data
+
+    for failed_chunk in insights.get("failed_chunks", []):
+        print(f"Failed to aggregate lines {failed_chunk["first_line"]}-{failed_chunk["first_line"] + failed_chunk["line_count"] - 1}: {failed_chunk["error"]}")
+
+    # Persist the buckets so history survives between runs
+    if aggregator.config.store_path:
+        TimeSeriesStore(aggregator.config.store_path).append(insights)
     
     print("Requests Per Hour:")
     for time_key, count in insights["time_aggregation"].items():
@@ -29,6 +37,12 @@ if __name__ == "__main__":
 
     print("\n")
 
+    print("Distinct Referrers And User Agents:")
+    for time_key, counts in insights["distinct_counts"].items():
+        print(f"{time_key}: {counts["referrers"]} referrers, {counts["user_agents"]} user agents")
+
+    print("\n")
+
     print("Detected Anomalies:")
     spikes = insights.get("spikes", {})
     if spikes:
@@ -37,4 +51,19 @@ if __name__ == "__main__":
                 print(f"{time_key}: {count} {anomaly_type}")
     else:
         print("No anomalies detected.")
+
+    print("\n")
+
+    print("Detected Route And Status Class Anomalies:")
+    series_spikes = insights.get("series_spikes", {})
+    partial_routes = series_spikes.get("partial_routes", {})
+    for route, route_spikes in series_spikes.get("routes", {}).items():
+        # Counts of partially tracked routes are lower bounds
+        approximate = " (at least)" if route in partial_routes else ""
+        for anomaly_type, spike_data in route_spikes.items():
+            for time_key, count in spike_data.items():
+                print(f"{time_key}: {count}{approximate} {anomaly_type} on {route}")
+    for status_class, spike_data in series_spikes.get("status_classes", {}).items():
+        for time_key, count in spike_data.items():
+            print(f"{time_key}: {count} {status_class} responses")
             
\ No newline at end of file
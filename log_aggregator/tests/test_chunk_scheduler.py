@@ -0,0 +1,131 @@
+import concurrent.futures
+import functools
+import os
+import tempfile
+import time
+import unittest
+from classes.chunk_scheduler import ChunkScheduler
+
+
+def first_attempt(marker):
+    # Attempts run in other processes, a marker file tells the first attempt of a chunk from its retries
+    if os.path.exists(marker):
+        return False
+    open(marker, "w").close()
+    return True
+
+
+def square(value):
+    return value * value
+
+
+def flaky_square(marker, value):
+    if first_attempt(marker):
+        raise RuntimeError("flaky")
+    return value * value
+
+
+def broken(value):
+    raise RuntimeError(f"broken {value}")
+
+
+def slow_square(marker, value, seconds):
+    if first_attempt(marker):
+        time.sleep(seconds)
+    return value * value
+
+
+def crashing_square(marker, value):
+    if first_attempt(marker):
+        # Kills the worker process, which breaks the whole pool
+        os._exit(1)
+    return value * value
+
+
+class ChunkSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def make_scheduler(self, **options):
+        scheduler = ChunkScheduler(
+            functools.partial(concurrent.futures.ProcessPoolExecutor, max_workers=2), 2, **options
+        )
+        self.addCleanup(scheduler.shutdown)
+        return scheduler
+
+    def marker(self, name="marker"):
+        return os.path.join(self.directory.name, name)
+
+    def test_retries_failed_attempt(self):
+        scheduler = self.make_scheduler(max_retries=1, speculation_threshold=1)
+        flaky = scheduler.submit(flaky_square, self.marker(), 3)
+        steady = scheduler.submit(square, 4)
+
+        self.assertEqual(dict(scheduler.results()), {flaky: 9, steady: 16})
+        self.assertEqual(scheduler.failed, {})
+        self.assertEqual(scheduler.stats["retries"], 1)
+
+    def test_fails_after_last_retry(self):
+        scheduler = self.make_scheduler(max_retries=1, speculation_threshold=1)
+        chunk_id = scheduler.submit(broken, 5)
+
+        self.assertEqual(list(scheduler.results()), [])
+        self.assertEqual(scheduler.failed, {chunk_id: "broken 5"})
+        self.assertEqual(scheduler.stats["retries"], 1)
+
+    def test_retries_timed_out_attempt(self):
+        scheduler = self.make_scheduler(max_retries=1, timeout=0.5, speculation_threshold=1)
+        chunk_id = scheduler.submit(slow_square, self.marker(), 6, 30)
+
+        started = time.monotonic()
+        self.assertEqual(dict(scheduler.results()), {chunk_id: 36})
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(scheduler.stats["timeouts"], 1)
+        self.assertEqual(scheduler.failed, {})
+
+    def test_restarts_pool_held_by_stuck_attempts(self):
+        scheduler = self.make_scheduler(max_retries=1, timeout=0.5, speculation_threshold=1)
+        chunk_ids = [scheduler.submit(slow_square, self.marker(f"stuck{value}"), value, 30) for value in range(2)]
+
+        started = time.monotonic()
+        self.assertEqual(dict(scheduler.results()), {chunk_ids[0]: 0, chunk_ids[1]: 1})
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(scheduler.stats["timeouts"], 2)
+        self.assertEqual(scheduler.stats["pool_restarts"], 1)
+
+    def test_timeout_clock_starts_on_a_free_worker(self):
+        # Four 0.4 second chunks on two workers, the last two would time out if queue time was counted
+        scheduler = self.make_scheduler(max_retries=0, timeout=0.7, speculation_threshold=1)
+        chunk_ids = [scheduler.submit(slow_square, self.marker(f"queued{value}"), value, 0.4) for value in range(4)]
+
+        self.assertEqual(dict(scheduler.results()), {chunk_id: value * value for value, chunk_id in enumerate(chunk_ids)})
+        self.assertEqual(scheduler.stats["timeouts"], 0)
+        self.assertEqual(scheduler.failed, {})
+
+    def test_speculates_straggler_and_discards_duplicate(self):
+        # Chunks of similar length, or the median would be near zero and every pending chunk a straggler
+        scheduler = self.make_scheduler(speculation_threshold=0.5, speculation_factor=3)
+        fast = [scheduler.submit(slow_square, self.marker(f"fast{value}"), value, 0.2) for value in range(3)]
+        straggler = scheduler.submit(slow_square, self.marker(), 7, 5)
+
+        results = list(scheduler.results())
+        self.assertEqual(sorted(chunk_id for chunk_id, _ in results), sorted(fast + [straggler]))
+        self.assertEqual(dict(results)[straggler], 49)
+        self.assertEqual(scheduler.stats["speculative"], 1)
+        self.assertEqual(scheduler.stats["duplicates_discarded"], 1)
+
+    def test_restarts_broken_pool(self):
+        scheduler = self.make_scheduler(max_retries=2, speculation_threshold=1)
+        crashing = scheduler.submit(crashing_square, self.marker(), 8)
+        steady = [scheduler.submit(square, value) for value in range(4)]
+
+        results = dict(scheduler.results())
+        self.assertEqual(results[crashing], 64)
+        self.assertEqual([results[chunk_id] for chunk_id in steady], [0, 1, 4, 9])
+        self.assertEqual(scheduler.failed, {})
+        self.assertGreaterEqual(scheduler.stats["pool_restarts"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import pickle
+import unittest
+from classes.hyper_log_log import HyperLogLog
+
+
+def sketch(values, error_rate=0.02):
+    hll = HyperLogLog(error_rate)
+    for value in values:
+        hll.add(value)
+    return hll
+
+
+class HyperLogLogTest(unittest.TestCase):
+    def test_accuracy(self):
+        # Four standard errors, so the deterministic hashes stay well inside the bound
+        for cardinality in (10, 1000, 50000):
+            hll = sketch(f"user-{value}" for value in range(cardinality))
+            self.assertLessEqual(abs(hll.count() - cardinality), max(1, 4 * 0.02 * cardinality), cardinality)
+
+    def test_duplicates_are_not_counted(self):
+        hll = sketch(f"user-{value % 100}" for value in range(10000))
+        self.assertLessEqual(abs(hll.count() - 100), 4)
+
+    def test_merge_is_union(self):
+        # Covers sparse into sparse, sparse into dense and dense into dense
+        for left_size, right_size in ((20, 30), (5000, 30), (20, 5000), (5000, 8000)):
+            left = sketch(f"user-{value}" for value in range(left_size))
+            right = sketch(f"user-{value}" for value in range(left_size // 2, left_size // 2 + right_size))
+            union = sketch(f"user-{value}" for value in range(max(left_size, left_size // 2 + right_size)))
+
+            self.assertEqual(left.merge(right).count(), union.count(), (left_size, right_size))
+
+    def test_sparse_switches_to_dense(self):
+        hll = HyperLogLog()
+        hll.add("user-0")
+        self.assertIsNone(hll.registers)
+
+        for value in range(hll.register_count):
+            hll.add(f"user-{value}")
+        self.assertIsNone(hll._sparse)
+        self.assertEqual(len(hll.registers), hll.register_count)
+
+    def test_count_is_cached_until_changed(self):
+        hll = sketch(f"user-{value}" for value in range(100))
+        first = hll.count()
+        self.assertEqual(hll._cached_count, first)
+
+        hll.add("user-100")
+        self.assertIsNone(hll._cached_count)
+        hll.merge(sketch(["other"]))
+        self.assertGreater(hll.count(), first)
+
+    def test_pickle_round_trip(self):
+        for cardinality in (10, 5000):
+            hll = sketch(f"user-{value}" for value in range(cardinality))
+            copy = pickle.loads(pickle.dumps(hll))
+            self.assertEqual(copy.count(), hll.count())
+            copy.add("other")
+            self.assertEqual(copy.merge(hll).precision, hll.precision)
+
+    def test_precision_mismatch_is_rejected(self):
+        with self.assertRaises(ValueError):
+            HyperLogLog(0.02).merge(HyperLogLog(0.1))
+
+    def test_invalid_error_rate_is_rejected(self):
+        for error_rate in (0, 1, -0.5):
+            with self.assertRaises(ValueError):
+                HyperLogLog(error_rate)
+
+
+if __name__ == "__main__":
+    unittest.main()
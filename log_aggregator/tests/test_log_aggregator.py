@@ -0,0 +1,117 @@
+import json
+import os
+import pickle
+import random
+import tempfile
+import unittest
+from classes.dense_time_series import DenseTimeSeries
+from classes.log_aggregator import LogAggregator
+
+
+class FailingMergeAggregator(LogAggregator):
+    def merge_aggregations(self, base, new):
+        self.merges = getattr(self, "merges", 0) + 1
+        if self.merges == 2:
+            raise ValueError("bad chunk")
+        return super().merge_aggregations(base, new)
+
+
+class LogAggregatorTest(unittest.TestCase):
+    """
+    Runs the sampled and exact aggregations over a small generated log file
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        log_path = os.path.join(self.directory.name, "log.txt")
+        rng = random.Random(7)
+        with open(log_path, "w") as f:
+            for _ in range(3000):
+                f.write(
+                    f"2025-03-08T{rng.randrange(24):02d}:{rng.randrange(60):02d}:00 GET /products/{rng.randrange(30)} "
+                    f"{rng.choice(['200', '200', '404', '500'])} 512 http://a.com/{rng.randrange(50)} ua{rng.randrange(9)}\n"
+                )
+
+        self.config_path = os.path.join(self.directory.name, "config.json")
+        with open(self.config_path, "w") as f:
+            json.dump({
+                "file_path": log_path,
+                "chunk_size": 500,
+                "max_workers": 2,
+                "time_interval": "minute",
+                "sample_block_size": 4096,
+                "sample_seed": 1
+            }, f)
+        self.aggregator = LogAggregator(self.config_path)
+
+    def test_full_fraction_is_exact(self):
+        exact = self.aggregator.aggregate()
+        sample = self.aggregator.aggregate_sample(1)
+
+        self.assertEqual(sample["time_aggregation"], exact["time_aggregation"])
+        self.assertEqual(sample["most_requested_routes"], exact["most_requested_routes"])
+        self.assertEqual(sample["response_code_distribution"], exact["response_code_distribution"])
+        self.assertEqual(sample["sample"]["blocks_read"], sample["sample"]["block_count"])
+        self.assertEqual(sample["failed_chunks"], [])
+
+        intervals = sample["confidence_intervals"]
+        for time_key, counts in exact["time_aggregation"].items():
+            self.assertEqual(intervals["time_aggregation"][time_key]["total"], (counts["total"], counts["total"]))
+            self.assertEqual(intervals["time_aggregation"][time_key]["errors"], (counts["errors"], counts["errors"]))
+        for code, count in exact["response_code_distribution"].items():
+            self.assertEqual(intervals["response_code_distribution"][code], (count, count))
+
+    def test_pickled_aggregator_drops_results(self):
+        self.aggregator.aggregate()
+        copy = pickle.loads(pickle.dumps(self.aggregator))
+
+        self.assertEqual(copy._aggregated_data, {})
+        self.assertTrue(copy._time_series.is_empty())
+        self.assertEqual(copy._route_series, {})
+        self.assertTrue(self.aggregator._aggregated_data)
+
+    def test_merge_failure_is_reported(self):
+        data = FailingMergeAggregator(self.config_path).aggregate()
+
+        self.assertEqual(len(data["failed_chunks"]), 1)
+        self.assertEqual(data["failed_chunks"][0]["line_count"], 500)
+        self.assertEqual(data["failed_chunks"][0]["error"], "Merge failed: bad chunk")
+        self.assertEqual(sum(data["response_code_distribution"].values()), 2500)
+
+
+class DenseTimeSeriesTest(unittest.TestCase):
+    def test_pickle_round_trip(self):
+        series = DenseTimeSeries()
+        rng = random.Random(3)
+        # A few far apart buckets end up in sparse segments, a full range of buckets in dense ones
+        for _ in range(200):
+            series.add(rng.randrange(10 ** 6), rng.randrange(1, 9), rng.randrange(2))
+        for index in range(DenseTimeSeries.SEGMENT_SIZE):
+            series.add(index, 2, 1)
+
+        copy = pickle.loads(pickle.dumps(series))
+        self.assertEqual(list(copy.buckets()), list(series.buckets()))
+        self.assertEqual(copy.sums(), series.sums())
+
+    def test_merge_sparse_and_dense_segments(self):
+        left, right = DenseTimeSeries(), DenseTimeSeries()
+        for index in range(0, DenseTimeSeries.SEGMENT_SIZE, 2):
+            left.add(index, 1, 0)
+        right.add(4, 3, 1)
+        right.add(DenseTimeSeries.SEGMENT_SIZE * 5, 2, 2)
+
+        left.merge(right)
+        self.assertEqual(left.get(4), (4, 1))
+        self.assertEqual(left.get(DenseTimeSeries.SEGMENT_SIZE * 5), (2, 2))
+        self.assertEqual(left.sums(), (DenseTimeSeries.SEGMENT_SIZE // 2 + 5, 3))
+
+        dense = DenseTimeSeries()
+        for index in range(DenseTimeSeries.SEGMENT_SIZE):
+            dense.add(index, 1, 1)
+        left.merge(dense)
+        self.assertEqual(left.get(1), (1, 1))
+        self.assertEqual(left.get(4), (5, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
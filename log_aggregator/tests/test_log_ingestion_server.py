@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import unittest
+from classes.log_aggregator import LogAggregator
+from classes.log_ingestion_server import LogIngestionServer
+from classes.time_series_store import TimeSeriesStore
+
+
+def log_line(timestamp, route="/index.html", code="200"):
+    return f"{timestamp} GET {route} {code} 512 http://a.com curl/8"
+
+
+class LogIngestionServerTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Drives LogIngestionServer through local TCP/UDP sockets bound to ephemeral ports
+    """
+    def make_server(self, store=None, **config):
+        config = {
+            "time_interval": "minute",
+            "ingest_tcp_port": 0,
+            "ingest_udp_port": 0,
+            "allowed_lateness": 0,
+            **config
+        }
+        config_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(config_dir.cleanup)
+        config_path = os.path.join(config_dir.name, "config.json")
+        with open(config_path, "w") as f:
+            json.dump(config, f)
+
+        self.closed = []
+        return LogIngestionServer(
+            LogAggregator(config_path), on_window_closed=lambda key, window, spikes: self.closed.append(key), store=store
+        )
+
+    async def wait_for(self, condition, timeout=5):
+        async with asyncio.timeout(timeout):
+            while not condition():
+                await asyncio.sleep(0.01)
+
+    async def send_tcp(self, server, lines):
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.tcp_port)
+        writer.write("".join(line + "\n" for line in lines).encode("utf-8"))
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    def key(self, server, timestamp):
+        return server.aggregator.get_time_key(timestamp)
+
+    async def test_windows_close_in_order(self):
+        server = self.make_server()
+        await server.start()
+        await self.send_tcp(server, [
+            log_line("2025-03-08T10:00:10"),
+            log_line("2025-03-08T10:01:10"),
+            log_line("2025-03-08T10:02:10"),
+            log_line("2025-03-08T10:03:10")
+        ])
+        await self.wait_for(lambda: server.stats["ingested"] == 4)
+
+        self.assertEqual(self.closed, [
+            self.key(server, "2025-03-08T10:00:10"),
+            self.key(server, "2025-03-08T10:01:10"),
+            self.key(server, "2025-03-08T10:02:10")
+        ])
+        await server.stop()
+        self.assertEqual(self.closed[-1], self.key(server, "2025-03-08T10:03:10"))
+        self.assertEqual(len(server.data["time_aggregation"]), 4)
+
+    async def test_late_and_out_of_order_lines(self):
+        server = self.make_server(allowed_lateness=150)
+        await server.start()
+        await self.send_tcp(server, [
+            log_line("2025-03-08T10:00:10"),
+            # Out of order but within the allowed lateness
+            log_line("2025-03-08T10:00:05"),
+            # Moves the watermark to 10:02:30 and closes 10:00
+            log_line("2025-03-08T10:05:00"),
+            # Out of order, in the bucket of the watermark
+            log_line("2025-03-08T10:02:40"),
+            # Below the bucket of the watermark, its window would close immediately
+            log_line("2025-03-08T10:01:30"),
+            # Belongs to a closed window
+            log_line("2025-03-08T10:00:50")
+        ])
+        await self.wait_for(lambda: server.stats["ingested"] + server.stats["late"] == 6)
+        await server.stop()
+
+        self.assertEqual(server.stats["ingested"], 4)
+        self.assertEqual(server.stats["late"], 2)
+        time_aggregation = server.data["time_aggregation"]
+        self.assertEqual(time_aggregation["2025-03-08T10:00:00"]["total"], 2)
+        self.assertNotIn("2025-03-08T10:01:00", time_aggregation)
+        self.assertEqual(time_aggregation["2025-03-08T10:02:00"]["total"], 1)
+        self.assertEqual(self.closed, sorted(self.closed))
+
+    async def test_udp_lines_dropped_when_queue_full(self):
+        server = self.make_server(ingest_queue_size=2)
+        await server.start()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        # A single datagram is queued in one go, before the consumer gets to run
+        lines = [log_line(f"2025-03-08T10:00:{second:02d}") for second in range(5)]
+        sock.sendto("\n".join(lines).encode("utf-8"), ("127.0.0.1", server.udp_port))
+        await self.wait_for(lambda: server.stats["ingested"] + server.stats["dropped"] == 5)
+        await server.stop()
+
+        self.assertEqual(server.stats["ingested"], 2)
+        self.assertEqual(server.stats["dropped"], 3)
+
+    async def test_stop_with_connected_client(self):
+        server = self.make_server()
+        await server.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.tcp_port)
+        self.addCleanup(writer.close)
+        writer.write((log_line("2025-03-08T10:00:10") + "\n").encode("utf-8"))
+        await writer.drain()
+        await self.wait_for(lambda: server.stats["ingested"] == 1)
+
+        # The client keeps its connection open
+        await asyncio.wait_for(server.stop(), timeout=5)
+        self.assertEqual(self.closed, [self.key(server, "2025-03-08T10:00:10")])
+        self.assertEqual(await asyncio.wait_for(reader.read(), timeout=5), b"")
+
+    async def test_closed_windows_are_stored(self):
+        store_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(store_dir.cleanup)
+        store = TimeSeriesStore(store_dir.name)
+        server = self.make_server(store=store)
+        await server.start()
+        await self.send_tcp(server, [
+            log_line(f"2025-03-08T10:{minute:02d}:10", code=str(200 + minute % 2)) for minute in range(10)
+        ])
+        await self.wait_for(lambda: server.stats["ingested"] == 10)
+        await server.stop()
+
+        stored = store.read_range()
+        self.assertEqual(len(stored["time_aggregation"]), 10)
+        self.assertEqual(stored["response_code_distribution"], {"200": 5, "201": 5})
+        self.assertEqual(stored["response_codes_per_bucket"]["2025-03-08T10:03:00"], {"201": 1})
+
+    def test_future_line_does_not_move_watermark(self):
+        server = self.make_server()
+        server.ingest_line(log_line("2099-01-01T00:00:00"))
+        for second in range(100):
+            server.ingest_line(log_line(f"2025-03-08T10:{second // 60:02d}:{second % 60:02d}"))
+        server.flush()
+
+        self.assertEqual(server.stats["malformed"], 1)
+        self.assertEqual(server.stats["late"], 0)
+        self.assertEqual(server.stats["ingested"], 100)
+
+    def test_route_and_code_counts_are_bounded(self):
+        server = self.make_server(ingest_max_tracked_keys=4)
+        for minute in range(10):
+            for route in range(minute + 1):
+                server.ingest_line(log_line(f"2025-03-08T10:{minute:02d}:00", f"/products/{route}", str(200 + route)))
+        server.flush()
+
+        routes = server.data["most_requested_routes"]
+        self.assertLessEqual(len(routes), 4)
+        self.assertLessEqual(len(server.data["response_code_distribution"]), 4)
+        self.assertEqual(routes["/products/0"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from classes.time_series_store import TimeSeriesStore
+
+
+def epoch(time_key):
+    return int(datetime.strptime(time_key, TimeSeriesStore.TIMESTAMP_FORMAT).timestamp())
+
+
+def aggregation(buckets, spikes=None):
+    """
+    Build aggregation data from {time_key: {code: count}}, totals are the sum of the codes and 500s are errors
+    """
+    return {
+        "time_aggregation": {
+            time_key: {"total": sum(codes.values()), "errors": codes.get("500", 0)} for time_key, codes in buckets.items()
+        },
+        "response_codes_per_bucket": buckets,
+        "distinct_counts": {time_key: {"referrers": 2, "user_agents": 3} for time_key in buckets},
+        "spikes": spikes or {"requests": {}, "errors": {}}
+    }
+
+
+class TimeSeriesStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.store = TimeSeriesStore(self.directory.name)
+
+    def test_round_trip(self):
+        self.store.append(aggregation(
+            {"2025-03-08T10:00:00": {"200": 4, "500": 1}, "2025-03-08T11:00:00": {"200": 7}},
+            spikes={"requests": {"2025-03-08T11:00:00": 7}, "errors": {}}
+        ))
+
+        data = TimeSeriesStore(self.directory.name).read_range(sort_order="desc")
+        self.assertEqual(list(data["time_aggregation"]), ["2025-03-08T11:00:00", "2025-03-08T10:00:00"])
+        self.assertEqual(data["time_aggregation"]["2025-03-08T10:00:00"], {"total": 5, "errors": 1})
+        self.assertEqual(data["distinct_counts"]["2025-03-08T11:00:00"], {"referrers": 2, "user_agents": 3})
+        self.assertEqual(data["spikes"], {"requests": {"2025-03-08T11:00:00": 7}, "errors": {}})
+        self.assertEqual(data["response_code_distribution"], {"200": 11, "500": 1})
+
+    def test_range_only_counts_codes_of_its_buckets(self):
+        self.store.append(aggregation({
+            "2025-03-08T10:00:00": {"200": 4},
+            "2025-03-08T11:00:00": {"404": 2},
+            "2025-03-08T12:00:00": {"500": 3}
+        }))
+
+        data = self.store.read_range(epoch("2025-03-08T10:30:00"), epoch("2025-03-08T12:00:00"))
+        self.assertEqual(list(data["time_aggregation"]), ["2025-03-08T11:00:00", "2025-03-08T12:00:00"])
+        self.assertEqual(data["response_code_distribution"], {"404": 2, "500": 3})
+
+    def test_latest_append_wins(self):
+        self.store.append(aggregation({"2025-03-08T10:00:00": {"200": 4}, "2025-03-08T11:00:00": {"200": 1}}))
+        self.store.append(aggregation({"2025-03-08T11:00:00": {"200": 6, "500": 2}}))
+
+        data = self.store.read_range()
+        self.assertEqual(data["time_aggregation"]["2025-03-08T10:00:00"], {"total": 4, "errors": 0})
+        self.assertEqual(data["time_aggregation"]["2025-03-08T11:00:00"], {"total": 8, "errors": 2})
+        self.assertEqual(data["response_codes_per_bucket"]["2025-03-08T11:00:00"], {"200": 6, "500": 2})
+        self.assertEqual(data["response_code_distribution"], {"200": 10, "500": 2})
+
+    def test_truncated_trailing_record_is_ignored(self):
+        self.store.append(aggregation({"2025-03-08T10:00:00": {"200": 4}}))
+        # An append interrupted before its segment record was written
+        for name in ("buckets.dat", "codes.dat"):
+            with open(os.path.join(self.directory.name, name), "ab") as f:
+                f.write(b"\x01" * 5)
+
+        store = TimeSeriesStore(self.directory.name)
+        self.assertEqual(store.read_range()["time_aggregation"], {"2025-03-08T10:00:00": {"total": 4, "errors": 0}})
+        store.append(aggregation({"2025-03-08T11:00:00": {"404": 1}}))
+        data = store.read_range()
+        self.assertEqual(len(data["time_aggregation"]), 2)
+        self.assertEqual(data["response_code_distribution"], {"200": 4, "404": 1})
+
+    def test_unsupported_version_is_rejected(self):
+        path = os.path.join(self.directory.name, "buckets.dat")
+        with open(path, "r+b") as f:
+            f.write(TimeSeriesStore.HEADER.pack(TimeSeriesStore.MAGIC, 1, TimeSeriesStore.BUCKET_RECORD.size))
+
+        with self.assertRaises(ValueError):
+            TimeSeriesStore(self.directory.name)
+
+
+if __name__ == "__main__":
+    unittest.main()